@@ -1,10 +1,17 @@
-from functools import lru_cache
-from typing import Optional, Mapping
-
-from fastapi import FastAPI, Security, HTTPException, status
-from fastapi.security import APIKeyHeader
-from pydantic import BaseModel, Field
+import asyncio
+import hmac
+from contextlib import asynccontextmanager
+from functools import cache
+from typing import Awaitable, Callable, Dict, List, Optional, Mapping, Tuple
+
+import orjson
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from smart import __version__
 from smart.schedule import Schedule
@@ -22,26 +29,65 @@ class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env")
 
 
-app = FastAPI()
-
-api_key_header = APIKeyHeader(name="x-api-key", auto_error=False)
-
-
-def get_api_key(api_key_header: str = Security(api_key_header)) -> str:
-    settings = get_settings()
-    if settings.api_key is not None and api_key_header == settings.api_key:
-        return api_key_header
-    raise HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Invalid or missing API Key",
-    )
-
-
-@lru_cache
+class APIKeyMiddleware:
+    """Reject HTTP requests without a valid ``x-api-key`` header."""
+
+    UNAUTHORIZED_BODY = b'{"detail":"Invalid or missing API Key"}'
+
+    def __init__(self, app: ASGIApp, public_paths: frozenset = frozenset()):
+        self.app = app
+        self.public_paths = public_paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in self.public_paths:
+            await self.app(scope, receive, send)
+            return
+        api_key = get_settings().api_key.encode()
+        for name, value in scope["headers"]:
+            if name == b"x-api-key":
+                if hmac.compare_digest(value, api_key):
+                    await self.app(scope, receive, send)
+                    return
+                break
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 401,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(self.UNAUTHORIZED_BODY)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": self.UNAUTHORIZED_BODY})
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await variables_batcher.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(
+    APIKeyMiddleware,
+    public_paths=frozenset(
+        {
+            app.openapi_url,
+            app.docs_url,
+            app.redoc_url,
+            app.swagger_ui_oauth2_redirect_url,
+        }
+    ),
+)
+
+
+@cache
 def get_settings():
     return Settings()
 
 
+@cache
 def get_client():
     settings = get_settings()
     client = TadoClient(
@@ -54,44 +100,47 @@ def get_client():
 
 
 @app.get("/")
-async def root(api_key: str = Security(get_api_key)):
+async def root():
     return {"version": __version__}
 
 
 @app.post("/tado/home")
-async def home(api_key: str = Security(get_api_key)):
-    client = get_client()
-    client.set_home()
-    if client.get_presence() != Presence.HOME:
+async def home(verify: bool = False):
+    client = await run_in_threadpool(get_client)
+    await run_in_threadpool(client.set_home)
+    if verify and await run_in_threadpool(client.get_presence) != Presence.HOME:
         raise HTTPException(500, "Failed to update presence.")
     return {"presence": Presence.HOME}
 
 
 @app.post("/tado/away")
-async def away(api_key: str = Security(get_api_key)):
-    client = get_client()
-    client.set_away()
-    if client.get_presence() != Presence.AWAY:
+async def away(verify: bool = False):
+    client = await run_in_threadpool(get_client)
+    await run_in_threadpool(client.set_away)
+    if verify and await run_in_threadpool(client.get_presence) != Presence.AWAY:
         raise HTTPException(500, "Failed to update presence.")
     return {"presence": Presence.AWAY}
 
 
 @app.post("/tado/schedule/reset")
-async def reset(api_key: str = Security(get_api_key)):
+async def reset():
     settings = get_settings()
-    client = get_client()
-    schedule = Schedule(client=client)
-    schedule.set(settings.tado_default_schedule)
-    schedule.push()
+    client = await run_in_threadpool(get_client)
+    client.clear_active_timetables()
+    schedule = await run_in_threadpool(Schedule, client=client)
+    await run_in_threadpool(schedule.set, settings.tado_default_schedule)
+    await run_in_threadpool(schedule.push)
     variables = {k: v["value"] for k, v in schedule.current_variables.items()}
     return {"schedule": schedule.current_schedule, "variables": variables}
 
 
 @app.get("/tado/schedule/active")
-async def active(api_key: str = Security(get_api_key)):
-    client = get_client()
-    schedule = Schedule(client=client)
-    active_schedule, variables = schedule.active_schedule
+async def active():
+    client = await run_in_threadpool(get_client)
+    schedule = await run_in_threadpool(Schedule, client=client)
+    active_schedule, variables = await run_in_threadpool(
+        lambda: schedule.active_schedule
+    )
     return {
         "schedule": active_schedule,
         "variables": variables,
@@ -99,10 +148,20 @@ async def active(api_key: str = Security(get_api_key)):
 
 
 @app.get("/tado/schedule/all")
-async def all_schedules(api_key: str = Security(get_api_key)):
-    client = get_client()
-    schedules = Schedule.get(client=client, load=False)
-    return {k: {kk: vv["value"] for kk, vv in v.items()} for k, v in schedules.items()}
+async def all_schedules():
+    client = await run_in_threadpool(get_client)
+    schedules = await run_in_threadpool(Schedule.get, client=client, load=False)
+
+    async def stream():
+        # Encode one schedule at a time instead of building the whole response
+        separator = b"{"
+        for name, variables in schedules.items():
+            values = {k: v["value"] for k, v in variables.items()}
+            yield separator + orjson.dumps(name) + b":" + orjson.dumps(values)
+            separator = b","
+        yield b"}" if separator == b"," else b"{}"
+
+    return StreamingResponse(stream(), media_type="application/json")
 
 
 class ScheduleConfig(BaseModel):
@@ -110,30 +169,114 @@ class ScheduleConfig(BaseModel):
     variables: Mapping = Field(default_factory=dict)
 
 
-@app.post("/tado/schedule/set")
-async def set_schedule(config: ScheduleConfig, api_key: str = Security(get_api_key)):
-    client = get_client()
-    schedule = Schedule(client=client)
-    schedule.set(config.name, **config.variables)
-    schedule.push()
+@app.post(
+    "/tado/schedule/set",
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "application/json": {"schema": ScheduleConfig.model_json_schema()}
+            },
+            "required": True,
+        }
+    },
+)
+async def set_schedule(request: Request):
+    # Validate the raw body directly rather than through a body dependency
+    try:
+        config = ScheduleConfig.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors()]
+        )
+    client = await run_in_threadpool(get_client)
+    schedule = await run_in_threadpool(Schedule, client=client)
+    await run_in_threadpool(schedule.set, config.name, **config.variables)
+    await run_in_threadpool(schedule.push)
     variables = {k: v["value"] for k, v in schedule.current_variables.items()}
     return {"schedule": schedule.current_schedule, "variables": variables}
 
 
 @app.get("/tado/schedule/variables")
-async def get_schedule_variables(api_key: str = Security(get_api_key)):
-    client = get_client()
-    return Schedule.variables(client=client)
+async def get_schedule_variables():
+    client = await run_in_threadpool(get_client)
+    return await run_in_threadpool(Schedule.variables, client=client)
+
+
+class VariablesBatcher:
+    """Coalesce concurrent variable updates into one write and push at a time.
+
+    A single background task takes the next queued update, waits ``window``
+    seconds for others to queue up behind it, then applies the merged updates
+    once and shares the result. Batches are applied one after another.
+    """
+
+    def __init__(
+        self, apply: Callable[[Mapping], Awaitable[Dict]], window: float = 0.05
+    ):
+        self.apply = apply
+        self.window = window
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def submit(self, variables: Mapping) -> Dict:
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.get_loop() is not loop:
+            self.queue = asyncio.Queue()
+            self.task = loop.create_task(self._run())
+        future = loop.create_future()
+        self.queue.put_nowait((variables, future))
+        return await future
+
+    async def aclose(self) -> None:
+        """Stop the background task, cancelling updates not yet applied."""
+        task, self.task = self.task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        batch: List[Tuple[Mapping, asyncio.Future]] = []
+        try:
+            while True:
+                batch = [await self.queue.get()]
+                await asyncio.sleep(self.window)
+                while not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                merged = {}
+                for update, _ in batch:
+                    merged.update(update)
+                try:
+                    result = await self.apply(merged)
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():  # its submitter gave up
+                            future.set_exception(e)
+                else:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_result(result)
+        finally:
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            for _, future in batch:
+                future.cancel()
+
+
+async def update_schedule_variables(variables: Mapping) -> Dict:
+    client = await run_in_threadpool(get_client)
+    variables = await run_in_threadpool(
+        Schedule.variables, client=client, update=variables
+    )
+    schedule = await run_in_threadpool(Schedule, client=client)
+    await run_in_threadpool(schedule.set, refresh=True)
+    if not await run_in_threadpool(schedule.is_active):
+        await run_in_threadpool(schedule.push)
+    return variables
+
+
+variables_batcher = VariablesBatcher(update_schedule_variables)
 
 
 @app.post("/tado/schedule/variables")
-async def set_schedule_variables(
-    variables: Mapping, api_key: str = Security(get_api_key)
-):
-    client = get_client()
-    variables = Schedule.variables(client=client, update=variables)
-    schedule = Schedule(client=client)
-    schedule.set(refresh=True)
-    if not schedule.is_active():
-        schedule.push()
-    return variables
+async def set_schedule_variables(variables: Mapping):
+    return await variables_batcher.submit(variables)
@@ -1,20 +1,110 @@
-import copy
-import json
 import tomllib
-import datetime
-from functools import cached_property
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, lru_cache
+from pathlib import Path
 from typing import MutableMapping, List, Mapping, Tuple, Dict, Union
 
+import orjson
+
 from smart.tado import TadoClient
+from smart.utils import atomic_write_bytes
 from smart.schedule_utils import (
     ScheduleVariables,
     parse_dynamic_times,
     by_time,
     create_block,
     parse_dynamic_time,
+    to_minutes,
 )
 
 
+@lru_cache(maxsize=128)
+def load_toml(path: Path, mtime_ns: int) -> Dict:
+    """Parse a TOML file, cached until its modification time changes.
+
+    The returned mapping is shared between callers and must not be mutated.
+    """
+    return tomllib.loads(path.read_bytes().decode())
+
+
+@lru_cache(maxsize=128)
+def load_variants(path: Path, mtime_ns: int) -> Tuple[Dict, Tuple[Tuple[str, Dict]]]:
+    """Split a TOML schedule file into its zones and named variant metadata.
+
+    Cached until the file's modification time changes. The returned objects are
+    shared between callers and must not be mutated.
+    """
+    schedule = dict(load_toml(path, mtime_ns))
+    metadata = schedule.pop("metadata", {})
+    variants = []
+    for variant in [metadata] + schedule.pop("variant", []):
+        variant_metadata = {**metadata, **variant}
+        variant_name = variant_metadata.pop("name")
+        variants.append((variant_name, variant_metadata))
+    return schedule, tuple(variants)
+
+
+_JSON_CACHE: Dict[Path, Tuple[Tuple[int, int], object]] = {}
+
+
+def load_json(path: Path):
+    """Read a JSON file, cached in memory until the file changes on disk.
+
+    The returned object is shared between callers and must not be mutated.
+    """
+    stat = path.stat()
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _JSON_CACHE.get(path)
+    if cached is None or cached[0] != version:
+        cached = version, orjson.loads(path.read_bytes())
+        _JSON_CACHE[path] = cached
+    return cached[1]
+
+
+def dump_json(path: Path, data) -> None:
+    """Atomically write a JSON file and keep its in-memory cache up to date."""
+    atomic_write_bytes(path, orjson.dumps(data))
+    stat = path.stat()
+    _JSON_CACHE[path] = (stat.st_mtime_ns, stat.st_size), data
+
+
+_SCHEDULES_CACHE: Dict[Path, Tuple[Tuple, "Schedules"]] = {}
+
+
+def load_schedules(
+    path: Path,
+    global_variables: Dict = None,
+    variables: ScheduleVariables = None,
+    zones: List[Dict] = None,
+    **kwargs,
+) -> "Schedules":
+    """Build the schedules in a directory, cached until any of their inputs change.
+
+    The returned object is shared between callers and must not be mutated.
+    """
+    key = (
+        tuple(
+            sorted(
+                (config.name, config.stat().st_mtime_ns)
+                for config in path.glob("*.toml")
+            )
+        ),
+        orjson.dumps(global_variables or {}),
+        orjson.dumps(variables.data if variables else {}),
+        tuple(zone["name"] for zone in zones or []),
+        tuple(sorted(kwargs.items())),
+    )
+    cached = _SCHEDULES_CACHE.get(path)
+    if cached is None or cached[0] != key:
+        cached = key, Schedules(path, global_variables, variables, zones, **kwargs)
+        _SCHEDULES_CACHE[path] = cached
+    return cached[1]
+
+
+def _values_of(variables: Mapping) -> Dict:
+    return {k: v["value"] for k, v in variables.items()}
+
+
 class ZoneSchedule:
     def __init__(self, client: TadoClient, zone: Mapping):
         self.client: TadoClient = client
@@ -22,40 +112,41 @@ class ZoneSchedule:
         self.zone_name: str = zone["name"]
         self.json: List[MutableMapping] = []
 
-    @cached_property
+    @property
     def active_timetable(self) -> int:
-        url = self.endpoint + "/activeTimetable"
-        r = self.client.requests_session.get(url=url, headers={**self.client.auth})
-        r.raise_for_status()
-        data = r.json()
-        if data["type"] != "ONE_DAY":
-            raise NotImplementedError("Only single day schedule is supported.")
-        return data["id"]
+        """Active timetable ID, cached by the client across requests."""
+        return self.client.active_timetable(self.zone_id)
 
-    @property
+    @cached_property
     def endpoint(self) -> str:
         """Zone schedule endpoint."""
-        home = f"{self.client.v2_endpoint}/homes/{self.client.home_id}"
-        zone = f"{home}/zones/{self.zone_id}"
+        zone = f"{self.client.home_endpoint}/zones/{self.zone_id}"
         schedule = f"{zone}/schedule"
         return schedule
 
-    def pull(self) -> None:
+    def pull(self, headers: Mapping = None) -> None:
         """Get the current schedule."""
         url = self.endpoint + f"/timetables/{self.active_timetable}/blocks"
-        r = self.client.requests_session.get(url=url, headers={**self.client.auth})
-        r.raise_for_status()
+        r = self.client.requests_session.get(
+            url=url, headers=headers or self.client.auth
+        )
+        self._raise_for_status(r)
         self.json = r.json()
 
-    def push(self) -> None:
+    def push(self, headers: Mapping = None) -> None:
         """Set the current schedule."""
         url = (
             self.endpoint
             + f"/timetables/{self.active_timetable}/blocks/MONDAY_TO_SUNDAY"
         )
         r = self.client.requests_session.put(
-            url=url, json=self.json, headers={**self.client.auth}
+            url=url, json=self.json, headers=headers or self.client.auth
         )
+        self._raise_for_status(r)
+
+    def _raise_for_status(self, r) -> None:
+        if r.status_code == 404:  # the active timetable may have been switched
+            self.client.forget_active_timetable(self.zone_id)
         r.raise_for_status()
 
     def set(self, schedule: Mapping) -> None:
@@ -73,15 +164,25 @@ class Schedule:
         self.current_schedule: MutableMapping = {}
         self.current_variables: MutableMapping = {}
 
+    def _map_zones(self, method: str) -> None:
+        """Call a method on every zone schedule concurrently."""
+        headers = self.client.auth  # refresh the token once, not per zone
+        max_workers = min(8, max(len(self.zone_schedules), 1))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(
+                executor.map(
+                    lambda schedule: getattr(schedule, method)(headers=headers),
+                    self.zone_schedules,
+                )
+            )
+
     def pull(self) -> None:
         """Get the current schedule."""
-        for schedule in self.zone_schedules:
-            schedule.pull()
+        self._map_zones("pull")
 
     def push(self) -> None:
         """Set the current schedule."""
-        for schedule in self.zone_schedules:
-            schedule.push()
+        self._map_zones("push")
         self.active_schedule = self.current_schedule, self.current_variables
 
     def set(self, name: str = None, /, refresh: bool = False, **kwargs) -> None:
@@ -114,7 +215,7 @@ class Schedule:
         if name is None and kwargs:
             raise ValueError("Cannot pass `kwargs` to `get` when `name` not specified.")
 
-        schedules = Schedules(
+        schedules = load_schedules(
             client.data / "schedules",
             Schedule.variables(client),
             variables,
@@ -144,9 +245,7 @@ class Schedule:
 
     @property
     def active_schedule(self) -> Tuple[str, MutableMapping]:
-        path = self.client.data / "active_schedule.json"
-        with open(path) as fp:
-            data = json.load(fp)
+        data = load_json(self.client.data / "active_schedule.json")
         return data["schedule"], data["variables"]
 
     @active_schedule.setter
@@ -154,8 +253,12 @@ class Schedule:
         schedule, variables = value
         data = {"schedule": schedule, "variables": variables}
         path = self.client.data / "active_schedule.json"
-        with path.open("w") as fp:
-            json.dump(data, fp)
+        try:
+            if load_json(path) == data:
+                return
+        except FileNotFoundError:
+            pass
+        dump_json(path, data)
 
     @classmethod
     def variables(
@@ -163,23 +266,20 @@ class Schedule:
     ) -> Dict[str, str]:
         """Return global schedule variables."""
         path = client.data / "variables.json"
-        if path.exists():
-            with path.open() as fp:
-                v = json.load(fp)
-        else:
+        try:
+            v = load_json(path)
+        except FileNotFoundError:
             v = {}
         if update:
-            v.update(update)
-            with path.open("w") as fp:
-                json.dump(v, fp)
+            v = {**v, **update}
+            dump_json(path, v)
         return v
 
     def is_active(self):
         """Check if the schedule is active."""
         active_schedule, active_variables = self.active_schedule
         return (active_schedule == self.current_schedule) and (
-            ScheduleVariables(active_variables)
-            == ScheduleVariables(self.current_variables)
+            _values_of(active_variables) == _values_of(self.current_variables)
         )
 
 
@@ -192,17 +292,14 @@ class Schedules:
         zones: List[Dict] = None,
         **kwargs,
     ):
+        global_variables = global_variables or {}
         self.zones = [zone["name"].lower().replace(" ", "_") for zone in zones or []]
         self.schedules = {}
+        self._timetables = {}
         for config in path.glob("*.toml"):
-            with open(config, "rb") as fp:
-                schedule = tomllib.load(fp)
-            metadata = schedule.pop("metadata", {})
-            variants = [metadata] + schedule.pop("variant", [])
-
-            for variant in variants:
-                variant_metadata = {**metadata, **variant}
-                variant_name = variant_metadata.pop("name")
+            schedule, variants = load_variants(config, config.stat().st_mtime_ns)
+
+            for variant_name, variant_metadata in variants:
                 variant_variables = (
                     variables.copy() if variables else ScheduleVariables()
                 )
@@ -214,18 +311,22 @@ class Schedules:
                         if k not in variant_variables
                     }
                 )
-                if global_variables:
+                # Only build the filtered mappings when something overlaps
+                shared_globals = global_variables.keys() & variant_metadata.keys()
+                if shared_globals:
+                    existing_globals = variant_variables.globals
                     variant_variables.add_global(
                         **{
                             k: v
                             for k, v in global_variables.items()
-                            if k in variant_metadata
-                            and k not in variant_variables.globals
+                            if k in shared_globals and k not in existing_globals
                         }
                     )
-                variant_variables.add_kwarg(
-                    **{k: v for k, v in kwargs.items() if k in variant_metadata}
-                )
+                shared_kwargs = kwargs.keys() & variant_metadata.keys()
+                if shared_kwargs:
+                    variant_variables.add_kwarg(
+                        **{k: v for k, v in kwargs.items() if k in shared_kwargs}
+                    )
 
                 self.schedules[variant_name] = {
                     "schedule": schedule,
@@ -247,9 +348,20 @@ class Schedules:
         return schedule
 
     def load_zone(self, name: str, zone: str, tado_format: bool = True, **kwargs):
+        key = (name, zone, tuple(sorted(kwargs.items())))
+        if key not in self._timetables:  # copied zones are only built once
+            self._timetables[key] = self._load_timetable(name, zone, **kwargs)
+        timetable = self._timetables[key]
+
+        if tado_format:
+            return [create_block(*block) for block in timetable]
+        return timetable
+
+    def _load_timetable(self, name: str, zone: str, **kwargs):
         schedule = self.schedules[name]["schedule"].get(
             zone, [{"time": "00:00", "temperature": 0}]
         )
+        variables_values = self.variables_values(name)
 
         base_timetable = []
         for block in schedule:
@@ -257,7 +369,7 @@ class Schedules:
                 copy_block = block.copy()
                 copy_schedule = copy_block.pop("copy")
                 variables = {
-                    k: parse_dynamic_time(v, **self.variables_values(name))
+                    k: parse_dynamic_time(v, **variables_values)
                     for k, v in copy_block.items()
                 }
                 if ":" in copy_schedule:
@@ -273,19 +385,13 @@ class Schedules:
                     **variables,
                 )
                 break
-        schedule = list(filter(lambda block: "copy" not in block, schedule))
+        schedule = [block for block in schedule if "copy" not in block]
 
-        timetable = self.schedule_to_timetable(
-            schedule, **(self.variables_values(name) | kwargs)
-        )
+        timetable = self.schedule_to_timetable(schedule, **(variables_values | kwargs))
         if base_timetable:
             timetable = self.merge_timetables(base_timetable, timetable)
 
-        timetable = self.clean_timetable(timetable)
-
-        if tado_format:
-            return [create_block(*block) for block in timetable]
-        return timetable
+        return self.clean_timetable(timetable)
 
     @staticmethod
     def clean_timetable(timetable):
@@ -317,77 +423,66 @@ class Schedules:
 
     @staticmethod
     def merge_timetables(base_timetable, timetable):
-        timetable = [(*block, 0) for block in base_timetable] + [
-            (*block, 1) for block in timetable
-        ]
-        timetable = sorted(timetable, key=lambda x: x[0])
-
-        # Merge timetables
-        last_base_block = next(
-            filter(lambda block: block[-1] == 0, reversed(timetable))
-        )  # last base block
-        merged_timetable = []
-        start_block = None
-        for block in timetable:
-            if block[-1] == 1:
-                if block[2] == "reset":
-                    merged_timetable.append(
-                        (block[0], last_base_block[1], last_base_block[2])
-                    )
-                    start_block = None
-                else:
-                    start_block = block
-                    merged_timetable.append(block[:-1])
-            else:
-                last_base_block = block[:-1]
-                if start_block is None:
-                    merged_timetable.append(block[:-1])
-
-        # Cut overlapping end times
-        timetable = []
-        for idx in range(len(merged_timetable) - 1):
-            timetable.append(
-                (
-                    merged_timetable[idx][0],
-                    merged_timetable[idx + 1][0],
-                    merged_timetable[idx][2],
-                )
-            )
-        timetable.append(
-            (
-                merged_timetable[-1][0],
-                merged_timetable[0][0],
-                merged_timetable[-1][2],
-            )
+        # Base blocks sort before overlay blocks starting at the same time
+        blocks = sorted(
+            [(start, temperature, False) for start, _, temperature in base_timetable]
+            + [(start, temperature, True) for start, _, temperature in timetable],
+            key=lambda block: block[0],
         )
-        return Schedules.clean_timetable(timetable)
+
+        # Merge timetables, keeping only the start time and temperature
+        last_base_temperature = max(base_timetable, key=lambda block: block[0])[2]
+        starts = []
+        overridden = False
+        for start, temperature, overlay in blocks:
+            if not overlay:
+                last_base_temperature = temperature
+                if not overridden:
+                    starts.append((start, temperature))
+            elif temperature == "reset":
+                starts.append((start, last_base_temperature))
+                overridden = False
+            else:
+                starts.append((start, temperature))
+                overridden = True
+
+        # End each block where the next starts, dropping empty ranges and
+        # redundant splits as they are emitted
+        n_starts = len(starts)
+        merged = []
+        for idx, (start, temperature) in enumerate(starts):
+            end = starts[(idx + 1) % n_starts][0]
+            if n_starts > 1 and start == end:
+                continue
+            if merged and merged[-1][2] == temperature:
+                merged[-1] = (merged[-1][0], end, temperature)
+            else:
+                merged.append((start, end, temperature))
+
+        if len(merged) == 1:
+            merged = [("00:00", "00:00", merged[0][2])]
+
+        return merged
 
     @staticmethod
     def schedule_to_timetable(
         schedule: List[MutableMapping], /, **metadata
     ) -> List[Tuple[str, str, Union[float | int]]]:
-        data = []
-        schedule = copy.deepcopy(schedule)
+        schedule = [dict(block) for block in schedule]  # only "time" is rewritten
         parse_dynamic_times(schedule, **metadata)
         schedule.sort(key=by_time)
-        n_blocks = len(schedule)
-        for idx in range(n_blocks):
-            start = schedule[idx]["time"]
-            if idx + 1 >= n_blocks:
-                end = schedule[0]["time"]
-            else:
-                end = schedule[idx + 1]["time"]
-            temperature = schedule[idx]["temperature"]
-
-            # Split blocks at midnight
-            if not (start == "00:00" or end == "00:00"):
-                start_dt = datetime.datetime.strptime(start, "%H:%M")
-                end_dt = datetime.datetime.strptime(end, "%H:%M")
-                if end_dt < start_dt:  # block includes midnight
-                    data.insert(0, ("00:00", end, temperature))
-                    data.append((start, "00:00", temperature))
-                    continue
-
+        if not schedule:
+            return []
+        starts = [block["time"] for block in schedule]
+        temperatures = [block["temperature"] for block in schedule]
+        data = list(zip(starts, starts[1:], temperatures))
+
+        # Only the last block, which wraps around to the first, can include
+        # midnight; split it there unless the first block already starts then
+        start, end, temperature = starts[-1], starts[0], temperatures[-1]
+        if end != "00:00" and to_minutes(end) < to_minutes(start):
+            data = [("00:00", end, temperature), *data, (start, "00:00", temperature)]
+        else:
             data.append((start, end, temperature))
 
-        return sorted(data, key=lambda block: block[0])
+        return data
@@ -1,12 +1,19 @@
-import copy
 import re
-import datetime
 from collections import UserDict
 from typing import Mapping, List, MutableMapping
 
-_TIME_FMT = r"[0-9]{2}:[0-9]{2}"
-TIME_FMT = re.compile(_TIME_FMT)
-DYNAMIC_TIME_FMT = re.compile(rf"{{([A-Za-z0-9_]+)(\|([+-])({_TIME_FMT}))?}}")
+DYNAMIC_TIME = re.compile(
+    r"\{([A-Za-z0-9_]+)(?:\|([+-])([01][0-9]|2[0-3]):([0-5][0-9]))?\}"
+)
+# Variable values keep the unpadded ``H:MM`` forms that strptime accepted
+VARIABLE_TIME = re.compile(r"(2[0-3]|[01]?[0-9]):([0-5]?[0-9])")
+MINUTE_TIMES = tuple(f"{h:02d}:{m:02d}" for h in range(24) for m in range(60))
+VALID_TIMES = frozenset(MINUTE_TIMES)
+
+
+def to_minutes(time: str) -> int:
+    """Return the minutes since midnight of a validated ``HH:MM`` time."""
+    return int(time[:2]) * 60 + int(time[3:])
 
 
 def create_block(
@@ -39,31 +46,40 @@ def create_block(
     }
 
 
-def by_time(block: Mapping) -> datetime.datetime:
-    return datetime.datetime.strptime(block["time"], "%H:%M")
+def by_time(block: Mapping) -> int:
+    return to_minutes(block["time"])
 
 
 def _parse_dynamic_time(time: str, /, **kwargs) -> str:
-    m = re.fullmatch(DYNAMIC_TIME_FMT, time)
-    if m is None:
+    # `{variable}` or `{variable|±HH:MM}`, captured without slicing
+    match = DYNAMIC_TIME.fullmatch(time)
+    if match is None:
         raise ValueError(f"`{time}` not a valid dynamic format.")
-    variable, offset = m[1], m[2]
-    dt = datetime.datetime.strptime(kwargs[variable], "%H:%M")
-    if offset is not None:
-        sign, duration = m[3], m[4]
-        dt_offset = datetime.datetime.strptime(duration, "%H:%M")
-        minutes = 60 * dt_offset.hour + dt_offset.minute
-        if sign == "-":
-            minutes = -minutes
-        dt = dt + datetime.timedelta(minutes=minutes)
-    return dt.strftime("%H:%M")
+    variable, sign, hours, minutes = match.groups()
+    total = _variable_minutes(kwargs[variable])
+    if sign == "-":
+        total -= int(hours) * 60 + int(minutes)
+    elif sign:
+        total += int(hours) * 60 + int(minutes)
+    return MINUTE_TIMES[total % len(MINUTE_TIMES)]
+
+
+def _variable_minutes(value: str) -> int:
+    match = VARIABLE_TIME.fullmatch(value)
+    if match is None:
+        raise ValueError(f"`{value}` not a valid static format.")
+    return int(match[1]) * 60 + int(match[2])
+
+
+def _is_time(time: str) -> bool:
+    # A single hash lookup also rejects out-of-range hours and minutes
+    return time in VALID_TIMES
 
 
 def _parse_time(time: str) -> str:
-    m = re.fullmatch(TIME_FMT, time)
-    if m is None:
+    if not _is_time(time):
         raise ValueError(f"`{time}` not a valid static format.")
-    return m[0]
+    return time
 
 
 def parse_dynamic_time(time, **kwargs):
@@ -97,16 +113,23 @@ class ScheduleVariables(UserDict):
         self.data[key] = item
 
     def __eq__(self, other: MutableMapping):
-        a = {k: v["value"] for k, v in self.data.items()}
+        # Compare values in place, bailing out early on a size mismatch
         if isinstance(other, ScheduleVariables):
-            b = {k: v["value"] for k, v in other.data.items()}
-            return a == b
-        if a == other:
+            return len(other.data) == len(self.data) and all(
+                k in other.data and v["value"] == other.data[k]["value"]
+                for k, v in self.data.items()
+            )
+        if not isinstance(other, Mapping):
+            return False
+        if len(other) != len(self.data):
+            return False
+        if all(k in other and v["value"] == other[k] for k, v in self.data.items()):
             return True
         return self.data == other
 
     def copy(self):
-        return ScheduleVariables(copy.deepcopy(self.data))
+        # Entries are flat {"value", "type"} dicts, so one level is enough
+        return ScheduleVariables({k: dict(v) for k, v in self.data.items()})
 
     @property
     def globals(self):
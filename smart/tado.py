@@ -1,7 +1,14 @@
-from functools import cached_property
+import threading
+import time
+from functools import cached_property, lru_cache
 from pathlib import Path
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from smart.utils import atomic_write_bytes
 
 
 class Presence:
@@ -10,11 +17,52 @@ class Presence:
     AWAY = "AWAY"
 
 
+# Request bodies for the presence lock, serialized once
+PRESENCE_BODIES = {
+    presence: orjson.dumps({"homePresence": presence})
+    for presence in (Presence.HOME, Presence.AWAY)
+}
+
+
+@lru_cache(maxsize=8)
+def parse_env(env: str) -> dict:
+    """Map each ``key: 'value'`` entry in env.js to all of its values."""
+    values = {}
+    for line in env.split("\n"):
+        key, sep, value = line.strip().partition(":")
+        if sep and value.count("'") >= 2:
+            values.setdefault(key, []).append(value.split("'")[-2])
+    return values
+
+
 class TadoClient:
+    # Seconds before expiry at which the access token is renewed
+    TOKEN_EXPIRY_MARGIN = 30
+    # Seconds before renewal at which a background refresh is started
+    TOKEN_REFRESH_AHEAD = 120
+    # Seconds for which the home ID and zones are reused without a request
+    METADATA_MAX_AGE = 24 * 60 * 60
+    # Seconds for which a zone's active timetable ID is reused
+    ACTIVE_TIMETABLE_MAX_AGE = 10 * 60
+
     def __init__(self, username, password, data, env=None, requests_session=None):
         if env is None:
             env = "https://my.tado.com/webapp/env.js"
-        self.requests_session = requests_session or requests.Session()
+        if requests_session is None:
+            requests_session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=16,
+                pool_maxsize=32,
+                max_retries=Retry(
+                    total=3,
+                    backoff_factor=0.2,
+                    status_forcelist=(502, 503, 504),
+                    raise_on_status=False,  # leave it to raise_for_status
+                ),
+            )
+            requests_session.mount("https://", adapter)
+            requests_session.mount("http://", adapter)
+        self.requests_session = requests_session
         self.username = username
         self.password = password
         self.data = Path(data)
@@ -24,6 +72,13 @@ class TadoClient:
         self.client_secret = self.get_env("clientSecret")
         self.v1_endpoint = self.get_env("tgaRestApiEndpoint")
         self.v2_endpoint = self.get_env("tgaRestApiV2Endpoint")
+        self._access_token = None
+        self._access_token_expiry = 0.0
+        self._auth = {}
+        self._token_lock = threading.Lock()
+        self._refresh_thread = None
+        self._active_timetables = {}
+        self._http_cache_lock = threading.Lock()
 
     @cached_property
     def _env(self):
@@ -31,23 +86,51 @@ class TadoClient:
         return env.text
 
     def get_env(self, key, value=None):
-        values = list(
-            filter(
-                lambda x: key in x.strip(),
-                self._env.split("\n"),
-            )
-        )
+        values = parse_env(self._env).get(key, [])
         if len(values) == 0:
             if value is not None:
                 return value
             raise ValueError(f"`{key}` not in environment.")
         elif len(values) == 1:
-            return values[0].split("'")[-2]
+            return values[0]
         else:
             raise ValueError(f"Multiple `{key}` values found in environment.")
 
-    @cached_property
+    @property
     def access_token(self):
+        now = time.monotonic()
+        if self._access_token is None or now >= self._access_token_expiry:
+            with self._token_lock:  # another thread may have just refreshed it
+                if (
+                    self._access_token is None
+                    or time.monotonic() >= self._access_token_expiry
+                ):
+                    self._refresh_token()
+        elif now >= self._access_token_expiry - self.TOKEN_REFRESH_AHEAD:
+            if self._token_lock.acquire(blocking=False):
+                self._refresh_thread = threading.Thread(
+                    target=self._refresh_token_in_background, daemon=True
+                )
+                self._refresh_thread.start()
+        return self._access_token
+
+    def _refresh_token(self):
+        access_token, expires_in = self._request_token()
+        self._auth = {"Authorization": f"Bearer {access_token}"}
+        self._access_token = access_token
+        self._access_token_expiry = (
+            time.monotonic() + expires_in - self.TOKEN_EXPIRY_MARGIN
+        )
+
+    def _refresh_token_in_background(self):
+        try:
+            self._refresh_token()
+        except requests.RequestException:
+            pass  # the current token is still valid; retried on next access
+        finally:
+            self._token_lock.release()
+
+    def _request_token(self):
         r = self.requests_session.post(
             self.oauth_endpoint + "/token",
             data={
@@ -60,31 +143,100 @@ class TadoClient:
             },
         )
         r.raise_for_status()
-        return r.json()["access_token"]
+        data = r.json()
+        return data["access_token"], data.get("expires_in", 600)
 
     @property
     def auth(self):
-        return {"Authorization": f"Bearer {self.access_token}"}
+        # Rebuilt only when the token is renewed; requests does not mutate it
+        self.access_token
+        return self._auth
 
     @cached_property
-    def home_id(self):
-        r = self.requests_session.get(self.v1_endpoint + "/me", headers={**self.auth})
+    def _http_cache(self):
+        try:
+            return orjson.loads((self.data / "http_cache.json").read_bytes())
+        except FileNotFoundError:
+            return {}
+
+    def _get_json(self, url, max_age=0, fields=None):
+        """GET a JSON resource, reusing a persisted copy.
+
+        The copy is returned without a request while younger than ``max_age``
+        seconds, and is otherwise revalidated with its ETag, if it has one.
+        Given ``fields``, only those keys of the object are kept and returned.
+        """
+        key = f"{self.username} {url}"  # another account sees other homes
+        cached = self._http_cache.get(key)
+        if cached is not None and time.time() - cached.get("fetched", 0) < max_age:
+            return cached["body"]
+        headers = self.auth
+        if cached is not None and cached["etag"] is not None:
+            headers = {**headers, "If-None-Match": cached["etag"]}
+        r = self.requests_session.get(url, headers=headers)
+        if cached is not None and r.status_code == 304:
+            # Nothing to persist, only the age of the copy in memory is renewed
+            cached["fetched"] = time.time()
+            return cached["body"]
         r.raise_for_status()
-        return r.json()["homeId"]
+        data, etag = r.json(), r.headers.get("ETag")
+        if fields is not None:
+            data = {field: data[field] for field in fields}
+        if etag is not None or max_age:
+            with self._http_cache_lock:
+                self._http_cache[key] = {
+                    "etag": etag,
+                    "body": data,
+                    "fetched": time.time(),
+                }
+                if cached is None or (cached["etag"], cached["body"]) != (etag, data):
+                    atomic_write_bytes(
+                        self.data / "http_cache.json", orjson.dumps(self._http_cache)
+                    )
+        return data
 
-    @cached_property
+    # Read through the cache on every access so that a long-running client
+    # picks up a changed home or zones once METADATA_MAX_AGE has passed
+    @property
+    def home_id(self):
+        url = self.v1_endpoint + "/me"
+        # Keep the account's name and email out of the persisted copy
+        data = self._get_json(url, max_age=self.METADATA_MAX_AGE, fields=["homeId"])
+        return data["homeId"]
+
+    @property
+    def home_endpoint(self):
+        return f"{self.v2_endpoint}/homes/{self.home_id}"
+
+    @property
     def zones(self):
-        zones = f"{self.v2_endpoint}/homes/{self.home_id}/zones"
-        r = self.requests_session.get(zones, headers={**self.auth})
-        r.raise_for_status()
-        return r.json()
+        url = f"{self.home_endpoint}/zones"
+        return self._get_json(url, max_age=self.METADATA_MAX_AGE)
+
+    def active_timetable(self, zone_id):
+        cached = self._active_timetables.get(zone_id)
+        if cached is not None and time.monotonic() < cached[1]:
+            return cached[0]
+        zone = f"{self.home_endpoint}/zones/{zone_id}"
+        data = self._get_json(zone + "/schedule/activeTimetable")
+        if data["type"] != "ONE_DAY":
+            raise NotImplementedError("Only single day schedule is supported.")
+        expiry = time.monotonic() + self.ACTIVE_TIMETABLE_MAX_AGE
+        self._active_timetables[zone_id] = data["id"], expiry
+        return data["id"]
+
+    def forget_active_timetable(self, zone_id):
+        self._active_timetables.pop(zone_id, None)
+
+    def clear_active_timetables(self):
+        self._active_timetables.clear()
 
     def _set_presence(self, presence):
-        url = f"{self.v2_endpoint}/homes/{self.home_id}/presenceLock"
-        data = {
-            "homePresence": presence,
-        }
-        r = self.requests_session.put(url, json=data, headers={**self.auth})
+        url = f"{self.home_endpoint}/presenceLock"
+        headers = {**self.auth, "Content-Type": "application/json"}
+        r = self.requests_session.put(
+            url, data=PRESENCE_BODIES[presence], headers=headers
+        )
         r.raise_for_status()
 
     def set_home(self):
@@ -94,7 +246,7 @@ class TadoClient:
         self._set_presence(Presence.AWAY)
 
     def get_presence(self):
-        url = f"{self.v2_endpoint}/homes/{self.home_id}/state"
-        r = self.requests_session.get(url, headers={**self.auth})
+        url = f"{self.home_endpoint}/state"
+        r = self.requests_session.get(url, headers=self.auth)
         r.raise_for_status()
         return r.json().get("presence", None)
@@ -0,0 +1,27 @@
+import os
+import tempfile
+from pathlib import Path
+
+# Read once, as os.umask can only be queried by setting it
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Write a file so readers and other writers never see it half-written.
+
+    The data is written and fsynced to a uniquely named sibling file, which
+    then atomically replaces ``path``. The file gets the usual umask-based
+    permissions rather than the owner-only ones of a temporary file.
+    """
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f"{path.name}.", suffix=".tmp")
+    try:
+        with open(fd, "wb") as fp:
+            os.fchmod(fp.fileno(), 0o666 & ~UMASK)
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
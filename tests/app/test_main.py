@@ -1,52 +1,71 @@
-import json
+import asyncio
 import re
-import tempfile
-from functools import lru_cache
+import shutil
 from pathlib import Path
-from typing import Optional, Iterator
+from typing import AsyncIterator, Iterator
 from unittest.mock import patch
 
+import orjson
 import pytest
 import responses
-from fastapi.testclient import TestClient
-from pydantic_settings import BaseSettings
-
-from app.main import app
+from httpx import ASGITransport, AsyncClient
+
+from app.main import (
+    app,
+    get_client,
+    get_settings,
+    variables_batcher,
+    VariablesBatcher,
+)
 from smart import __version__
 
-
-class Settings(BaseSettings):
-    api_key: str = "test_api_key"
-    tado_username: str = "test_username"
-    tado_password: str = "test_password"
-    tado_data: str = tempfile.mkdtemp()
-    tado_default_schedule: str = "Schedule 2"
-    tado_env: Optional[str] = "http://localhost:8080/webapp/env.js"
+pytestmark = pytest.mark.anyio
 
 
-@lru_cache
-def get_test_settings():
-    return Settings()
+@pytest.fixture(scope="module")
+def requests_mock() -> Iterator[responses.RequestsMock]:
+    with responses.mock:
+        yield responses.mock
 
 
-@pytest.fixture(scope="session", autouse=True)
-def default_session_fixture() -> Iterator[None]:
-    with patch("app.main.get_settings", get_test_settings):
+@pytest.fixture(autouse=True)
+def mock_responses(requests_mock) -> Iterator[None]:
+    try:
         yield
-
-
-client = TestClient(app, headers={"x-api-key": "test_api_key"})
-
-auth_resp = {
-    "method": responses.GET,
-    "url": "http://localhost:8080/webapp/env.js",
-    "body": (Path(__file__).parent / "mock_env.js").read_text(),
-}
-
-token_resp = {
-    "method": responses.POST,
-    "url": "http://localhost:8080/oauth/token",
-    "match": (
+        not_called = [r for r in requests_mock.registered() if not r.call_count]
+        assert not not_called, f"Not all requests have been executed {not_called}"
+    finally:
+        # Shared responses below keep their call lists between registrations
+        for response in requests_mock.registered():
+            response.calls.reset()
+        requests_mock.reset()
+
+
+@pytest.fixture(scope="module")
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture(scope="module")
+async def client() -> AsyncIterator[AsyncClient]:
+    async with AsyncClient(
+        transport=ASGITransport(app=app),
+        base_url="http://testserver",
+        headers={"x-api-key": "test_api_key"},
+    ) as client:
+        yield client
+
+
+auth_resp = responses.Response(
+    method=responses.GET,
+    url="http://localhost:8080/webapp/env.js",
+    body=(Path(__file__).parent / "mock_env.js").read_text(),
+)
+
+token_resp = responses.Response(
+    method=responses.POST,
+    url="http://localhost:8080/oauth/token",
+    match=(
         responses.matchers.urlencoded_params_matcher(
             {
                 "client_id": "test-web-app",
@@ -58,60 +77,221 @@ token_resp = {
             }
         ),
     ),
-    "json": {"access_token": "access-token"},
+    body=orjson.dumps({"access_token": "access-token"}),
+    content_type="application/json",
+)
+
+home_id_resp = responses.Response(
+    method=responses.GET,
+    url="http://localhost:8081/api/v1/me",
+    headers={"Authorization": "Bearer access-token"},
+    body=orjson.dumps({"homeId": "123"}),
+    content_type="application/json",
+)
+
+zones_resp = responses.Response(
+    method=responses.GET,
+    url="http://localhost:8081/api/v2/homes/123/zones",
+    headers={"Authorization": "Bearer access-token"},
+    body=orjson.dumps(
+        [
+            {"id": 1, "name": "Dining Room", "type": "HEATING"},
+            {"id": 2, "name": "Bathroom", "type": "HEATING"},
+            {"id": 3, "name": "Living Room", "type": "HEATING"},
+        ]
+    ),
+    content_type="application/json",
+)
+
+active_timetable_resps = [
+    responses.Response(
+        method=responses.GET,
+        url=f"http://localhost:8081/api/v2/homes/123/zones/{zone}/schedule/activeTimetable",
+        headers={"Authorization": "Bearer access-token"},
+        body=orjson.dumps({"id": 0, "type": "ONE_DAY"}),
+        content_type="application/json",
+    )
+    for zone in (1, 2, 3)
+]
+
+
+reset_blocks = [
+    {
+        "dayType": "MONDAY_TO_SUNDAY",
+        "start": "00:00",
+        "end": "09:00",
+        "geolocationOverride": False,
+        "setting": {
+            "type": "HEATING",
+            "power": "OFF",
+            "temperature": None,
+        },
+    },
+    {
+        "dayType": "MONDAY_TO_SUNDAY",
+        "start": "09:00",
+        "end": "10:00",
+        "geolocationOverride": False,
+        "setting": {
+            "type": "HEATING",
+            "power": "ON",
+            "temperature": {"celsius": 21, "fahrenheit": 69.8},
+        },
+    },
+    {
+        "dayType": "MONDAY_TO_SUNDAY",
+        "start": "10:00",
+        "end": "17:00",
+        "geolocationOverride": False,
+        "setting": {
+            "type": "HEATING",
+            "power": "ON",
+            "temperature": {"celsius": 17.5, "fahrenheit": 63.5},
+        },
+    },
+    {
+        "dayType": "MONDAY_TO_SUNDAY",
+        "start": "17:00",
+        "end": "23:15",
+        "geolocationOverride": False,
+        "setting": {
+            "type": "HEATING",
+            "power": "ON",
+            "temperature": {"celsius": 22.5, "fahrenheit": 72.5},
+        },
+    },
+    {
+        "dayType": "MONDAY_TO_SUNDAY",
+        "start": "23:15",
+        "end": "00:00",
+        "geolocationOverride": False,
+        "setting": {
+            "type": "HEATING",
+            "power": "OFF",
+            "temperature": None,
+        },
+    },
+]
+
+set_blocks = [
+    {
+        "dayType": "MONDAY_TO_SUNDAY",
+        "start": "00:00",
+        "end": "09:58",
+        "geolocationOverride": False,
+        "setting": {
+            "type": "HEATING",
+            "power": "OFF",
+            "temperature": None,
+        },
+    },
+    {
+        "dayType": "MONDAY_TO_SUNDAY",
+        "start": "09:58",
+        "end": "10:43",
+        "geolocationOverride": False,
+        "setting": {
+            "type": "HEATING",
+            "power": "ON",
+            "temperature": {"celsius": 17.5, "fahrenheit": 63.5},
+        },
+    },
+    {
+        "dayType": "MONDAY_TO_SUNDAY",
+        "start": "10:43",
+        "end": "17:00",
+        "geolocationOverride": False,
+        "setting": {
+            "type": "HEATING",
+            "power": "ON",
+            "temperature": {"celsius": 21, "fahrenheit": 69.8},
+        },
+    },
+    {
+        "dayType": "MONDAY_TO_SUNDAY",
+        "start": "17:00",
+        "end": "23:15",
+        "geolocationOverride": False,
+        "setting": {
+            "type": "HEATING",
+            "power": "ON",
+            "temperature": {"celsius": 22.5, "fahrenheit": 72.5},
+        },
+    },
+    {
+        "dayType": "MONDAY_TO_SUNDAY",
+        "start": "23:15",
+        "end": "00:00",
+        "geolocationOverride": False,
+        "setting": {
+            "type": "HEATING",
+            "power": "OFF",
+            "temperature": None,
+        },
+    },
+]
+
+presence_matchers = {
+    presence: responses.matchers.json_params_matcher({"homePresence": presence})
+    for presence in ("HOME", "AWAY")
 }
+reset_blocks_matcher = responses.matchers.json_params_matcher(reset_blocks)
+set_blocks_matcher = responses.matchers.json_params_matcher(set_blocks)
 
-home_id_resp = {
-    "method": responses.GET,
-    "url": "http://localhost:8081/api/v1/me",
-    "headers": {"Authorization": "Bearer access-token"},
-    "json": {"homeId": "123"},
-}
 
-zones_resp = {
-    "method": responses.GET,
-    "url": "http://localhost:8081/api/v2/homes/123/zones",
-    "headers": {"Authorization": "Bearer access-token"},
-    "json": [
-        {"id": 1, "name": "Dining Room", "type": "HEATING"},
-        {"id": 2, "name": "Bathroom", "type": "HEATING"},
-        {"id": 3, "name": "Living Room", "type": "HEATING"},
-    ],
-}
+@pytest.fixture
+def mock_env():
+    responses.add(auth_resp)
 
-active_timetable_resp = {
-    "method": responses.GET,
-    "url": re.compile(
-        r"http://localhost:8081/api/v2/homes/123/zones/(1|2|3)/schedule/activeTimetable"
-    ),
-    "headers": {"Authorization": "Bearer access-token"},
-    "json": {"id": 0, "type": "ONE_DAY"},
-}
+
+@pytest.fixture
+def mock_home(mock_env):
+    responses.add(token_resp)
+    responses.add(home_id_resp)
+
+
+@pytest.fixture
+def mock_zones(mock_home):
+    responses.add(zones_resp)
+
+
+@pytest.fixture
+def mock_timetables(mock_zones):
+    for resp in active_timetable_resps:
+        responses.add(resp)
 
 
 def setup_module():
-    temp_dir = Path(get_test_settings().tado_data) / "schedules"
+    temp_dir = Path(get_settings().tado_data) / "schedules"
     temp_dir.mkdir()
     for i in range(1, 4):
         src = Path(__file__).parent / f"../sample_schedule_{i}.toml"
-        dst = temp_dir / f"sample_schedule_{i}.toml"
-        dst.write_text(src.read_text())
+        shutil.copyfile(src, temp_dir / f"sample_schedule_{i}.toml")
 
 
 class CommonTests:
     method: str
     url: str
 
-    def test_missing_api_key(self):
-        response = client.__getattribute__(self.method)(
+    async def test_missing_api_key(self, client):
+        response = await client.__getattribute__(self.method)(
             self.url, headers={"x-api-key": ""}
         )
         assert response.status_code == 401
         assert response.json() == {"detail": "Invalid or missing API Key"}
         assert response.headers["content-type"] == "application/json"
 
-    def test_invalid_api_key(self):
-        response = client.__getattribute__(self.method)(
+    async def test_no_api_key(self):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://testserver"
+        ) as anonymous:
+            response = await anonymous.__getattribute__(self.method)(self.url)
+        assert response.status_code == 401
+        assert response.json() == {"detail": "Invalid or missing API Key"}
+        assert response.headers["content-type"] == "application/json"
+
+    async def test_invalid_api_key(self, client):
+        response = await client.__getattribute__(self.method)(
             self.url, headers={"x-api-key": "invalid"}
         )
         assert response.status_code == 401
@@ -119,7 +299,8 @@ class CommonTests:
         assert response.headers["content-type"] == "application/json"
 
     def teardown_method(self):
-        for file in Path(get_test_settings().tado_data).glob("*.json"):
+        get_client.cache_clear()
+        for file in Path(get_settings().tado_data).glob("*.json"):
             file.unlink()
 
 
@@ -127,196 +308,78 @@ class TestRoot(CommonTests):
     method = "get"
     url = "/"
 
-    @responses.activate(assert_all_requests_are_fired=True)
-    def test_get(self):
-        response = client.get("/")
+    async def test_get(self, client):
+        response = await client.get("/")
         assert response.status_code == 200
         assert response.json() == {"version": __version__}
         assert response.headers["content-type"] == "application/json"
 
 
-class TestHome(CommonTests):
-    method = "post"
-    url = "/tado/home"
-
-    @responses.activate(assert_all_requests_are_fired=True)
-    def test_post(self):
-        responses.add(**auth_resp)
-        responses.add(**token_resp)
-        responses.add(**home_id_resp)
-        responses.add(
-            method=responses.PUT,
-            url="http://localhost:8081/api/v2/homes/123/presenceLock",
-            headers={"Authorization": "Bearer access-token"},
-            match=(responses.matchers.json_params_matcher({"homePresence": "HOME"}),),
-        )
-        responses.add(
-            method=responses.GET,
-            url="http://localhost:8081/api/v2/homes/123/state",
-            headers={"Authorization": "Bearer access-token"},
-            json={"presence": "HOME"},
-        )
-        response = client.post("/tado/home")
+class TestDocs:
+    @pytest.mark.parametrize("url", ["/docs", "/redoc", "/openapi.json"])
+    async def test_get_without_api_key(self, client, url):
+        response = await client.get(url, headers={"x-api-key": ""})
         assert response.status_code == 200
-        assert response.json() == {"presence": "HOME"}
-
-    @responses.activate(assert_all_requests_are_fired=True)
-    def test_post_did_not_update_state(self):
-        responses.add(**auth_resp)
-        responses.add(**token_resp)
-        responses.add(**home_id_resp)
-        responses.add(
-            method=responses.PUT,
-            url="http://localhost:8081/api/v2/homes/123/presenceLock",
-            headers={"Authorization": "Bearer access-token"},
-            match=(responses.matchers.json_params_matcher({"homePresence": "HOME"}),),
-        )
-        responses.add(
-            method=responses.GET,
-            url="http://localhost:8081/api/v2/homes/123/state",
-            headers={"Authorization": "Bearer access-token"},
-            json={"presence": "AWAY"},
-        )
-        response = client.post("/tado/home")
-        assert response.status_code == 500
 
 
-class TestAway(CommonTests):
+class PresenceTests(CommonTests):
     method = "post"
-    url = "/tado/away"
+    presence: str
 
-    @responses.activate(assert_all_requests_are_fired=True)
-    def test_post(self):
-        responses.add(**auth_resp)
-        responses.add(**token_resp)
-        responses.add(**home_id_resp)
+    @pytest.mark.parametrize("state", [None, "HOME", "AWAY"])
+    async def test_post(self, client, mock_home, state):
         responses.add(
             method=responses.PUT,
             url="http://localhost:8081/api/v2/homes/123/presenceLock",
             headers={"Authorization": "Bearer access-token"},
-            match=(responses.matchers.json_params_matcher({"homePresence": "AWAY"}),),
+            match=(presence_matchers[self.presence],),
         )
-        responses.add(
-            method=responses.GET,
-            url="http://localhost:8081/api/v2/homes/123/state",
-            headers={"Authorization": "Bearer access-token"},
-            json={"presence": "AWAY"},
-        )
-        response = client.post("/tado/away")
-        assert response.status_code == 200
-        assert response.json() == {"presence": "AWAY"}
+        if state is None:
+            response = await client.post(self.url)
+        else:
+            responses.add(
+                method=responses.GET,
+                url="http://localhost:8081/api/v2/homes/123/state",
+                headers={"Authorization": "Bearer access-token"},
+                json={"presence": state},
+            )
+            response = await client.post(self.url, params={"verify": True})
+        if state in (None, self.presence):
+            assert response.status_code == 200
+            assert response.json() == {"presence": self.presence}
+        else:
+            assert response.status_code == 500
 
-    @responses.activate(assert_all_requests_are_fired=True)
-    def test_post_did_not_update_state(self):
-        responses.add(**auth_resp)
-        responses.add(**token_resp)
-        responses.add(**home_id_resp)
-        responses.add(
-            method=responses.PUT,
-            url="http://localhost:8081/api/v2/homes/123/presenceLock",
-            headers={"Authorization": "Bearer access-token"},
-            match=(responses.matchers.json_params_matcher({"homePresence": "AWAY"}),),
-        )
-        responses.add(
-            method=responses.GET,
-            url="http://localhost:8081/api/v2/homes/123/state",
-            headers={"Authorization": "Bearer access-token"},
-            json={"presence": "HOME"},
-        )
-        response = client.post("/tado/away")
-        assert response.status_code == 500
+
+class TestHome(PresenceTests):
+    url = "/tado/home"
+    presence = "HOME"
+
+
+class TestAway(PresenceTests):
+    url = "/tado/away"
+    presence = "AWAY"
 
 
 class TestScheduleReset(CommonTests):
     method = "post"
     url = "/tado/schedule/reset"
 
-    @responses.activate(assert_all_requests_are_fired=True)
-    def test_post(self):
-        responses.add(**auth_resp)
-        responses.add(**token_resp)
-        responses.add(**home_id_resp)
-        responses.add(**zones_resp)
-        responses.add(**active_timetable_resp)
-        responses.add(**active_timetable_resp)
-        responses.add(**active_timetable_resp)
+    async def test_post(self, client, mock_timetables):
         responses.add(
             method=responses.PUT,
             url="http://localhost:8081/api/v2/homes/123/zones/1/schedule/timetables/0/blocks/MONDAY_TO_SUNDAY",
             headers={"Authorization": "Bearer access-token"},
-            match=(
-                responses.matchers.json_params_matcher(
-                    [
-                        {
-                            "dayType": "MONDAY_TO_SUNDAY",
-                            "start": "00:00",
-                            "end": "09:00",
-                            "geolocationOverride": False,
-                            "setting": {
-                                "type": "HEATING",
-                                "power": "OFF",
-                                "temperature": None,
-                            },
-                        },
-                        {
-                            "dayType": "MONDAY_TO_SUNDAY",
-                            "start": "09:00",
-                            "end": "10:00",
-                            "geolocationOverride": False,
-                            "setting": {
-                                "type": "HEATING",
-                                "power": "ON",
-                                "temperature": {"celsius": 21, "fahrenheit": 69.8},
-                            },
-                        },
-                        {
-                            "dayType": "MONDAY_TO_SUNDAY",
-                            "start": "10:00",
-                            "end": "17:00",
-                            "geolocationOverride": False,
-                            "setting": {
-                                "type": "HEATING",
-                                "power": "ON",
-                                "temperature": {"celsius": 17.5, "fahrenheit": 63.5},
-                            },
-                        },
-                        {
-                            "dayType": "MONDAY_TO_SUNDAY",
-                            "start": "17:00",
-                            "end": "23:15",
-                            "geolocationOverride": False,
-                            "setting": {
-                                "type": "HEATING",
-                                "power": "ON",
-                                "temperature": {"celsius": 22.5, "fahrenheit": 72.5},
-                            },
-                        },
-                        {
-                            "dayType": "MONDAY_TO_SUNDAY",
-                            "start": "23:15",
-                            "end": "00:00",
-                            "geolocationOverride": False,
-                            "setting": {
-                                "type": "HEATING",
-                                "power": "OFF",
-                                "temperature": None,
-                            },
-                        },
-                    ]
-                ),
-            ),
+            match=(reset_blocks_matcher,),
         )
         responses.add(
             method=responses.PUT,
-            url="http://localhost:8081/api/v2/homes/123/zones/2/schedule/timetables/0/blocks/MONDAY_TO_SUNDAY",
-            headers={"Authorization": "Bearer access-token"},
-        )
-        responses.add(
-            method=responses.PUT,
-            url="http://localhost:8081/api/v2/homes/123/zones/3/schedule/timetables/0/blocks/MONDAY_TO_SUNDAY",
+            url=re.compile(
+                r"http://localhost:8081/api/v2/homes/123/zones/[23]/schedule/timetables/0/blocks/MONDAY_TO_SUNDAY"
+            ),
             headers={"Authorization": "Bearer access-token"},
         )
-        response = client.post("/tado/schedule/reset")
+        response = await client.post("/tado/schedule/reset")
         assert response.status_code == 200
         assert response.json() == {
             "schedule": "Schedule 2",
@@ -328,16 +391,11 @@ class TestScheduleActive(CommonTests):
     method = "get"
     url = "/tado/schedule/active"
 
-    @responses.activate(assert_all_requests_are_fired=True)
-    def test_get(self):
-        (Path(get_test_settings().tado_data) / "active_schedule.json").write_text(
+    async def test_get(self, client, mock_zones):
+        (Path(get_settings().tado_data) / "active_schedule.json").write_text(
             '{"schedule": "My Schedule", "variables": {"var1": "value1"}}'
         )
-        responses.add(**auth_resp)
-        responses.add(**token_resp)
-        responses.add(**home_id_resp)
-        responses.add(**zones_resp)
-        response = client.get("/tado/schedule/active")
+        response = await client.get("/tado/schedule/active")
         assert response.status_code == 200
         assert response.json() == {
             "schedule": "My Schedule",
@@ -350,16 +408,11 @@ class TestScheduleAll(CommonTests):
     method = "get"
     url = "/tado/schedule/all"
 
-    @responses.activate(assert_all_requests_are_fired=True)
-    def test_get(self):
-        (Path(get_test_settings().tado_data) / "variables.json").write_text(
+    async def test_get(self, client, mock_zones):
+        (Path(get_settings().tado_data) / "variables.json").write_text(
             '{"var3": "14:00", "var4": "15:00"}'
         )
-        responses.add(**auth_resp)
-        responses.add(**token_resp)
-        responses.add(**home_id_resp)
-        responses.add(**zones_resp)
-        response = client.get("/tado/schedule/all")
+        response = await client.get("/tado/schedule/all")
         assert response.status_code == 200
         assert response.json() == {
             "Schedule 1": {},
@@ -370,105 +423,44 @@ class TestScheduleAll(CommonTests):
         }
         assert response.headers["content-type"] == "application/json"
 
+    async def test_get_empty(self, client, mock_env):
+        with patch("app.main.Schedule.get", return_value={}):
+            response = await client.get("/tado/schedule/all")
+        assert response.status_code == 200
+        assert response.json() == {}
+
 
 class TestScheduleSet(CommonTests):
     method = "post"
     url = "/tado/schedule/set"
 
-    @responses.activate(assert_all_requests_are_fired=True)
-    def test_post_default(self):
-        response = client.post("/tado/schedule/set")
+    async def test_post_default(self, client):
+        response = await client.post("/tado/schedule/set")
+        assert response.status_code == 422
+
+    async def test_post_invalid(self, client):
+        response = await client.post("/tado/schedule/set", json={"name": 1})
         assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == ["body", "name"]
 
-    @responses.activate(assert_all_requests_are_fired=True)
-    def test_post(self):
-        (Path(get_test_settings().tado_data) / "variables.json").write_text(
+    async def test_post(self, client, mock_timetables):
+        (Path(get_settings().tado_data) / "variables.json").write_text(
             '{"var3": "14:00", "var4": "15:00"}'
         )
-        responses.add(**auth_resp)
-        responses.add(**token_resp)
-        responses.add(**home_id_resp)
-        responses.add(**zones_resp)
-        responses.add(**active_timetable_resp)
-        responses.add(**active_timetable_resp)
-        responses.add(**active_timetable_resp)
         responses.add(
             method=responses.PUT,
             url="http://localhost:8081/api/v2/homes/123/zones/1/schedule/timetables/0/blocks/MONDAY_TO_SUNDAY",
             headers={"Authorization": "Bearer access-token"},
-            match=(
-                responses.matchers.json_params_matcher(
-                    [
-                        {
-                            "dayType": "MONDAY_TO_SUNDAY",
-                            "start": "00:00",
-                            "end": "09:58",
-                            "geolocationOverride": False,
-                            "setting": {
-                                "type": "HEATING",
-                                "power": "OFF",
-                                "temperature": None,
-                            },
-                        },
-                        {
-                            "dayType": "MONDAY_TO_SUNDAY",
-                            "start": "09:58",
-                            "end": "10:43",
-                            "geolocationOverride": False,
-                            "setting": {
-                                "type": "HEATING",
-                                "power": "ON",
-                                "temperature": {"celsius": 17.5, "fahrenheit": 63.5},
-                            },
-                        },
-                        {
-                            "dayType": "MONDAY_TO_SUNDAY",
-                            "start": "10:43",
-                            "end": "17:00",
-                            "geolocationOverride": False,
-                            "setting": {
-                                "type": "HEATING",
-                                "power": "ON",
-                                "temperature": {"celsius": 21, "fahrenheit": 69.8},
-                            },
-                        },
-                        {
-                            "dayType": "MONDAY_TO_SUNDAY",
-                            "start": "17:00",
-                            "end": "23:15",
-                            "geolocationOverride": False,
-                            "setting": {
-                                "type": "HEATING",
-                                "power": "ON",
-                                "temperature": {"celsius": 22.5, "fahrenheit": 72.5},
-                            },
-                        },
-                        {
-                            "dayType": "MONDAY_TO_SUNDAY",
-                            "start": "23:15",
-                            "end": "00:00",
-                            "geolocationOverride": False,
-                            "setting": {
-                                "type": "HEATING",
-                                "power": "OFF",
-                                "temperature": None,
-                            },
-                        },
-                    ],
-                ),
-            ),
+            match=(set_blocks_matcher,),
         )
         responses.add(
             method=responses.PUT,
-            url="http://localhost:8081/api/v2/homes/123/zones/2/schedule/timetables/0/blocks/MONDAY_TO_SUNDAY",
-            headers={"Authorization": "Bearer access-token"},
-        )
-        responses.add(
-            method=responses.PUT,
-            url="http://localhost:8081/api/v2/homes/123/zones/3/schedule/timetables/0/blocks/MONDAY_TO_SUNDAY",
+            url=re.compile(
+                r"http://localhost:8081/api/v2/homes/123/zones/[23]/schedule/timetables/0/blocks/MONDAY_TO_SUNDAY"
+            ),
             headers={"Authorization": "Bearer access-token"},
         )
-        response = client.post(
+        response = await client.post(
             "/tado/schedule/set",
             json={
                 "name": "Schedule 3.1",
@@ -486,13 +478,11 @@ class TestScheduleVariablesGet(CommonTests):
     method = "get"
     url = "/tado/schedule/variables"
 
-    @responses.activate(assert_all_requests_are_fired=True)
-    def test_get(self):
-        (Path(get_test_settings().tado_data) / "variables.json").write_text(
+    async def test_get(self, client, mock_env):
+        (Path(get_settings().tado_data) / "variables.json").write_text(
             '{"sleep": "23:00", "wake": "07:00"}'
         )
-        responses.add(**auth_resp)
-        response = client.get("/tado/schedule/variables")
+        response = await client.get("/tado/schedule/variables")
         assert response.status_code == 200
         assert response.json() == {
             "sleep": "23:00",
@@ -500,15 +490,23 @@ class TestScheduleVariablesGet(CommonTests):
         }
         assert response.headers["content-type"] == "application/json"
 
+    async def test_get_reuses_client(self, client, mock_env):
+        (Path(get_settings().tado_data) / "variables.json").write_text(
+            '{"sleep": "23:00", "wake": "07:00"}'
+        )
+        for _ in range(2):
+            response = await client.get("/tado/schedule/variables")
+            assert response.status_code == 200
+        assert len(responses.calls) == 1
+
 
 class TestScheduleVariablesPost(CommonTests):
     method = "post"
     url = "/tado/schedule/variables"
 
-    @responses.activate(assert_all_requests_are_fired=True)
-    def test_post(self):
-        (Path(get_test_settings().tado_data) / "active_schedule.json").write_text(
-            json.dumps(
+    async def test_post(self, client, mock_timetables):
+        (Path(get_settings().tado_data) / "active_schedule.json").write_bytes(
+            orjson.dumps(
                 {
                     "schedule": "Schedule 3",
                     "variables": {
@@ -519,18 +517,14 @@ class TestScheduleVariablesPost(CommonTests):
                 }
             )
         )
-        responses.add(**auth_resp)
-        responses.add(**token_resp)
-        responses.add(**home_id_resp)
-        responses.add(**zones_resp)
-        responses.add(**active_timetable_resp)
-        for zone in (1, 2, 3):
-            responses.add(
-                method=responses.PUT,
-                url=f"http://localhost:8081/api/v2/homes/123/zones/{zone}/schedule/timetables/0/blocks/MONDAY_TO_SUNDAY",
-                headers={"Authorization": "Bearer access-token"},
-            )
-        response = client.post(
+        responses.add(
+            method=responses.PUT,
+            url=re.compile(
+                r"http://localhost:8081/api/v2/homes/123/zones/[123]/schedule/timetables/0/blocks/MONDAY_TO_SUNDAY"
+            ),
+            headers={"Authorization": "Bearer access-token"},
+        )
+        response = await client.post(
             "/tado/schedule/variables", json={"var3": "15:00", "var4": "06:00"}
         )
         assert response.status_code == 200
@@ -540,10 +534,9 @@ class TestScheduleVariablesPost(CommonTests):
         }
         assert response.headers["content-type"] == "application/json"
 
-    @responses.activate(assert_all_requests_are_fired=True)
-    def test_post_no_update(self):
-        (Path(get_test_settings().tado_data) / "active_schedule.json").write_text(
-            json.dumps(
+    async def test_post_no_update(self, client, mock_zones):
+        (Path(get_settings().tado_data) / "active_schedule.json").write_bytes(
+            orjson.dumps(
                 {
                     "schedule": "Schedule 3",
                     "variables": {
@@ -554,11 +547,7 @@ class TestScheduleVariablesPost(CommonTests):
                 }
             )
         )
-        responses.add(**auth_resp)
-        responses.add(**token_resp)
-        responses.add(**home_id_resp)
-        responses.add(**zones_resp)
-        response = client.post(
+        response = await client.post(
             "/tado/schedule/variables",
             json={"var1": "06:00", "var3": "14:00", "var4": "06:00"},
         )
@@ -569,3 +558,97 @@ class TestScheduleVariablesPost(CommonTests):
             "var4": "06:00",
         }
         assert response.headers["content-type"] == "application/json"
+
+
+async def test_variables_batcher():
+    calls = []
+
+    async def apply(variables):
+        calls.append(variables)
+        return dict(variables)
+
+    batcher = VariablesBatcher(apply, window=0.01)
+    results = await asyncio.gather(
+        batcher.submit({"var1": "06:00", "var2": "07:00"}),
+        batcher.submit({"var2": "08:00"}),
+    )
+    assert calls == [{"var1": "06:00", "var2": "08:00"}]
+    assert results == [{"var1": "06:00", "var2": "08:00"}] * 2
+    await batcher.aclose()
+
+
+async def test_variables_batcher_raises_exception():
+    async def apply(variables):
+        raise ValueError("failed")
+
+    batcher = VariablesBatcher(apply, window=0.01)
+    results = await asyncio.gather(
+        batcher.submit({"var1": "06:00"}),
+        batcher.submit({"var2": "08:00"}),
+        return_exceptions=True,
+    )
+    assert [str(result) for result in results] == ["failed", "failed"]
+    await batcher.aclose()
+
+
+async def test_variables_batcher_one_batch_at_a_time():
+    running, overlapped = 0, False
+
+    async def apply(variables):
+        nonlocal running, overlapped
+        running += 1
+        overlapped |= running > 1
+        await asyncio.sleep(0.05)
+        running -= 1
+        return dict(variables)
+
+    batcher = VariablesBatcher(apply, window=0.01)
+    first = asyncio.ensure_future(batcher.submit({"var1": "06:00"}))
+    await asyncio.sleep(0.03)  # the first batch is being applied
+    second = await batcher.submit({"var2": "08:00"})
+    assert not overlapped
+    assert await first == {"var1": "06:00"}
+    assert second == {"var2": "08:00"}
+    await batcher.aclose()
+
+
+@pytest.mark.parametrize("fail", [False, True])
+async def test_variables_batcher_submitter_cancelled(fail):
+    async def apply(variables):
+        if fail:
+            raise ValueError("failed")
+        return dict(variables)
+
+    batcher = VariablesBatcher(apply, window=0.01)
+    first = asyncio.ensure_future(batcher.submit({"var1": "06:00"}))
+    second = asyncio.ensure_future(batcher.submit({"var2": "08:00"}))
+    await asyncio.sleep(0)
+    first.cancel()
+    if fail:
+        with pytest.raises(ValueError, match="failed"):
+            await second
+    else:
+        assert await second == {"var1": "06:00", "var2": "08:00"}
+    assert first.cancelled()
+    await batcher.aclose()
+
+
+async def test_variables_batcher_close():
+    async def apply(variables):  # pragma: no cover (closed before applying)
+        return dict(variables)
+
+    batcher = VariablesBatcher(apply, window=0.01)
+    first = asyncio.ensure_future(batcher.submit({"var1": "06:00"}))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(batcher.submit({"var2": "08:00"}))
+    await asyncio.sleep(0)  # the first is in a batch, the second still queued
+    await batcher.aclose()
+    await batcher.aclose()
+    results = await asyncio.gather(first, second, return_exceptions=True)
+    assert all(isinstance(r, asyncio.CancelledError) for r in results)
+
+
+async def test_lifespan_closes_variables_batcher():
+    async with app.router.lifespan_context(app):
+        pass
+    assert variables_batcher.task is None
@@ -1,77 +1,95 @@
+import os
+import shutil
 import tempfile
+from functools import cache
 from pathlib import Path
-from unittest.mock import Mock, patch, PropertyMock
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
 
 import pytest
 
-from smart.schedule import Schedule
+from smart.schedule import Schedule, ZoneSchedule
 from smart.tado import TadoClient
 
 
+def pytest_configure(config):
+    data = tempfile.mkdtemp()
+    config.add_cleanup(lambda: shutil.rmtree(data, ignore_errors=True))
+    os.environ.update(
+        {
+            "API_KEY": "test_api_key",
+            "TADO_USERNAME": "test_username",
+            "TADO_PASSWORD": "test_password",
+            "TADO_DATA": data,
+            "TADO_DEFAULT_SCHEDULE": "Schedule 2",
+            "TADO_ENV": "http://localhost:8080/webapp/env.js",
+        }
+    )
+
+
+@cache
+def mock_env_text():
+    return (Path(__file__).parent / "mock_env.txt").read_text().strip()
+
+
 class EnvResponse:
     def __init__(self, text):
         self.text = text
 
 
 @pytest.fixture
-def tado_client():
+def tado_client(tmp_path_factory):
     env = "http://localhost:8080/webapp/env.js"
 
     def get_env(url):
         assert url == env
-        with (Path(__file__).parent / "mock_env.txt").open() as fp:
-            text = fp.read().strip()
-        return EnvResponse(text=text)
+        return EnvResponse(text=mock_env_text())
 
-    requests_session = Mock()
-    requests_session.get.side_effect = get_env
     client = TadoClient(
         username="username",
         password="password",
-        data=".",
+        data=tmp_path_factory.mktemp("data"),
         env=env,
-        requests_session=requests_session,
+        requests_session=SimpleNamespace(get=get_env),
     )
     client.requests_session = Mock()
     return client
 
 
 @pytest.fixture
-def mock_tado_auth():
-    with patch(
-        "smart.tado.TadoClient.auth", new_callable=PropertyMock
-    ) as mock_property:
-        mock_property.return_value = {"Authorization": "Bearer access-token"}
-        yield mock_property
+def mock_tado_auth(monkeypatch):
+    auth = {"Authorization": "Bearer access-token"}
+    monkeypatch.setattr(TadoClient, "auth", auth)
+    return auth
 
 
 @pytest.fixture
-def mock_tado_home_id():
-    with patch(
-        "smart.tado.TadoClient.home_id", new_callable=PropertyMock
-    ) as mock_property:
-        mock_property.return_value = "123"
-        yield mock_property
+def mock_tado_home_id(monkeypatch):
+    monkeypatch.setattr(TadoClient, "home_id", "123")
+    return "123"
 
 
 @pytest.fixture
-def mock_active_timetable():
-    with patch(
-        "smart.schedule.ZoneSchedule.active_timetable", new_callable=PropertyMock
-    ) as mock_property:
-        mock_property.return_value = 0
-        yield mock_property
+def mock_active_timetable(monkeypatch):
+    monkeypatch.setattr(ZoneSchedule, "active_timetable", 0)
+    return 0
+
+
+@pytest.fixture(scope="session")
+def zones():
+    return [
+        {"id": 1, "name": "Dining Room", "type": "HEATING"},
+        {"id": 2, "name": "Bathroom", "type": "HEATING"},
+        {"id": 3, "name": "Living Room", "type": "HEATING"},
+    ]
 
 
 @pytest.fixture
-def schedule():
+def schedule(tmp_path_factory, zones):
     with patch("smart.schedule.ZoneSchedule", side_effect=Mock):
-        zones = [
-            {"id": 1, "name": "Dining Room", "type": "HEATING"},
-            {"id": 2, "name": "Bathroom", "type": "HEATING"},
-            {"id": 3, "name": "Living Room", "type": "HEATING"},
-        ]
-        tado_client = Mock()
-        tado_client.zones = zones
-        tado_client.data = Path(tempfile.mkdtemp())
+        tado_client = SimpleNamespace(
+            zones=zones,
+            data=tmp_path_factory.mktemp("data"),
+            auth={"Authorization": "Bearer access-token"},
+        )
         yield Schedule(tado_client)
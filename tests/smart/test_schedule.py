@@ -1,17 +1,54 @@
 import functools
-import json
-import shutil
+import os
 from pathlib import Path
+from types import SimpleNamespace
 from unittest.mock import Mock
 
+import orjson
 import pytest
+import requests
 
-from smart.schedule import Schedule, ZoneSchedule, Schedules
+from smart.schedule import (
+    Schedule,
+    ZoneSchedule,
+    Schedules,
+    dump_json,
+    load_json,
+    load_schedules,
+    load_variants,
+)
+
+
+SAMPLE_DIR = Path(__file__).parent.parent
+
+ACTIVE_SCHEDULE_3_1_JSON = orjson.dumps(
+    {
+        "schedule": "Schedule 3.1",
+        "variables": {
+            "var1": {"value": "08:00", "type": "kwarg"},
+            "var2": {"value": "10:00", "type": "default"},
+            "var3": {"value": "12:00", "type": "global"},
+        },
+    }
+)
+
+BASE_TIMETABLE = (
+    ("01:00", "03:00", 0),
+    ("03:00", "05:00", 3),
+    ("05:00", "07:00", 5),
+    ("07:00", "09:00", 7),
+    ("09:00", "18:00", 9),
+    ("18:00", "01:00", 18),
+)
 
 
 class HttpResponse:
+    __slots__ = ("_json", "status_code", "headers")
+
     def __init__(self, json=None):
         self._json = json
+        self.status_code = 200
+        self.headers = {}
 
     def json(self):
         return self._json
@@ -22,36 +59,25 @@ class HttpResponse:
 
 def setup_data(func):
     @functools.wraps(func)
-    def wrapper(self, tmp_path, schedule):
+    def wrapper(self, tmp_path, schedule, **kwargs):
         schedule.client.data = tmp_path
         dest = tmp_path / "schedules"
         dest.mkdir()
-        shutil.copy(
-            Path(__file__).parent.parent / "sample_schedule_1.toml", dest / "s1.toml"
-        )
-        shutil.copy(
-            Path(__file__).parent.parent / "sample_schedule_2.toml", dest / "s2.toml"
-        )
-        shutil.copy(
-            Path(__file__).parent.parent / "sample_schedule_3.toml", dest / "s3.toml"
-        )
-        shutil.copy(
-            Path(__file__).parent.parent / "sample_schedule_4.toml", dest / "s4.toml"
-        )
-        func(self, tmp_path, schedule)
+        for src in SAMPLE_DIR.glob("sample_schedule_*.toml"):
+            try:  # the tests only read the samples, so link instead of copying
+                os.link(src, dest / src.name)
+            except OSError:  # pragma: no cover (hard links unsupported)
+                import shutil
+
+                shutil.copyfile(src, dest / src.name)
+        func(self, tmp_path, schedule, **kwargs)
 
     return wrapper
 
 
 class TestSchedule:
-    def test_zone_schedules(self):
-        zones = [
-            {"id": 1, "name": "Dining Room", "type": "HEATING"},
-            {"id": 2, "name": "Bathroom", "type": "HEATING"},
-            {"id": 3, "name": "Living Room", "type": "HEATING"},
-        ]
-        tado_client = Mock()
-        tado_client.zones = zones
+    def test_zone_schedules(self, zones):
+        tado_client = SimpleNamespace(zones=zones)
 
         schedule = Schedule(tado_client)
 
@@ -90,6 +116,30 @@ class TestSchedule:
             },
         )
 
+    def test_push_unchanged(self, tmp_path, schedule):
+        schedule.current_schedule = "current-schedule"
+        schedule.client.data = tmp_path
+        path = tmp_path / "active_schedule.json"
+
+        schedule.push()
+        mtime_ns = path.stat().st_mtime_ns
+        os.utime(path, ns=(0, mtime_ns - 1))
+
+        schedule.push()
+        assert path.stat().st_mtime_ns == mtime_ns - 1
+        assert list(tmp_path.iterdir()) == [path]
+
+    def test_push_raises_exception(self, tmp_path, schedule):
+        schedule.client.data = tmp_path
+        schedule.zone_schedules[1].push.side_effect = RuntimeError("zone failed")
+
+        with pytest.raises(RuntimeError, match="zone failed"):
+            schedule.push()
+
+        for zone in schedule.zone_schedules:
+            zone.push.assert_called_once()
+        assert not (tmp_path / "active_schedule.json").exists()
+
     @setup_data
     def test_set(self, tmp_path, schedule):
         all_schedules = Schedule.get(client=schedule.client, name="Schedule 1")
@@ -100,9 +150,11 @@ class TestSchedule:
 
         schedule.set("Schedule 1")
 
-        assert len(schedule.zone_schedules) == 3
-        for zone in schedule.zone_schedules:
-            zone.set.assert_called_once_with(all_schedules[0])
+        assert [zone.set.call_count for zone in schedule.zone_schedules] == [1, 1, 1]
+        assert all(
+            zone.set.call_args.args == (all_schedules[0],)
+            for zone in schedule.zone_schedules
+        )
         assert schedule.current_schedule == "Schedule 1"
         assert schedule.current_variables == {}
 
@@ -118,9 +170,11 @@ class TestSchedule:
 
         schedule.set("Schedule 2", var1="07:00")
 
-        assert len(schedule.zone_schedules) == 3
-        for zone in schedule.zone_schedules:
-            zone.set.assert_called_once_with(all_schedules[0])
+        assert [zone.set.call_count for zone in schedule.zone_schedules] == [1, 1, 1]
+        assert all(
+            zone.set.call_args.args == (all_schedules[0],)
+            for zone in schedule.zone_schedules
+        )
         assert schedule.current_schedule == "Schedule 2"
         assert schedule.current_variables == {
             "var1": {"value": "07:00", "type": "kwarg"},
@@ -133,8 +187,8 @@ class TestSchedule:
             client=schedule.client, name="Schedule 3.1", var1="08:00"
         )
         active_schedule = schedule.client.data / "active_schedule.json"
-        active_schedule.write_text(
-            json.dumps(
+        active_schedule.write_bytes(
+            orjson.dumps(
                 {
                     "schedule": "Schedule 3.1",
                     "variables": {
@@ -153,9 +207,11 @@ class TestSchedule:
 
         schedule.set(var1="08:00")
 
-        assert len(schedule.zone_schedules) == 3
-        for zone in schedule.zone_schedules:
-            zone.set.assert_called_once_with(all_schedules[0])
+        assert [zone.set.call_count for zone in schedule.zone_schedules] == [1, 1, 1]
+        assert all(
+            zone.set.call_args.args == (all_schedules[0],)
+            for zone in schedule.zone_schedules
+        )
         assert schedule.current_schedule == "Schedule 3.1"
         assert schedule.current_variables == {
             "var1": {"value": "08:00", "type": "kwarg"},
@@ -165,8 +221,8 @@ class TestSchedule:
 
     @setup_data
     def test_get(self, tmp_path, schedule):
-        (schedule.client.data / "variables.json").write_text(
-            '{"var3": "14:00", "var4": "15:00"}'
+        (schedule.client.data / "variables.json").write_bytes(
+            b'{"var3": "14:00", "var4": "15:00"}'
         )
 
         schedule_1 = Schedule.get(client=schedule.client, name="Schedule 1")
@@ -228,8 +284,8 @@ class TestSchedule:
 
     @setup_data
     def test_get_no_name(self, tmp_path, schedule):
-        (schedule.client.data / "variables.json").write_text(
-            '{"var3": "14:00", "var4": "15:00"}'
+        (schedule.client.data / "variables.json").write_bytes(
+            b'{"var3": "14:00", "var4": "15:00"}'
         )
 
         all_schedules = Schedule.get(client=schedule.client)
@@ -330,16 +386,16 @@ class TestSchedule:
 
     @setup_data
     def test_variables(self, tmp_path, schedule):
-        (schedule.client.data / "variables.json").write_text(
-            '{"var10": "09:00", "var20": "10:00"}'
+        (schedule.client.data / "variables.json").write_bytes(
+            b'{"var10": "09:00", "var20": "10:00"}'
         )
         variables = Schedule.variables(client=schedule.client)
         assert variables == {"var10": "09:00", "var20": "10:00"}
 
     @setup_data
     def test_variables_update(self, tmp_path, schedule):
-        (schedule.client.data / "variables.json").write_text(
-            '{"var10": "09:00", "var20": "10:00"}'
+        (schedule.client.data / "variables.json").write_bytes(
+            b'{"var10": "09:00", "var20": "10:00"}'
         )
         variables = Schedule.variables(
             client=schedule.client,
@@ -347,104 +403,59 @@ class TestSchedule:
         )
         assert variables == {"var10": "08:00", "var20": "10:00", "var30": "11:00"}
 
+    def test_json_cache(self, tmp_path):
+        path = tmp_path / "variables.json"
+        dump_json(path, {"var1": "07:00"})
+        data = load_json(path)
+        assert data == {"var1": "07:00"}
+        assert load_json(path) is data
+
+        path.write_bytes(b'{"var1": "08:00"}')
+        os.utime(path, ns=(0, path.stat().st_mtime_ns + 1))
+        assert load_json(path) == {"var1": "08:00"}
+
+    @pytest.mark.parametrize(
+        "variables, active, var2, var3",
+        [
+            (
+                b'{"var1": "06:00", "var3": "12:00"}',
+                True,
+                {"value": "10:00", "type": "default"},
+                {"value": "12:00", "type": "global"},
+            ),
+            (
+                b'{"var1": "06:00", "var2": "10:00", "var3": "12:00", "var4-extra": "14:00"}',
+                True,
+                {"value": "10:00", "type": "global"},
+                {"value": "12:00", "type": "global"},
+            ),
+            (
+                b'{"var1": "06:00", "var2": "11:00", "var3": "12:00"}',
+                False,
+                {"value": "11:00", "type": "global"},
+                {"value": "12:00", "type": "global"},
+            ),
+            (
+                b'{"var1": "06:00", "var3": "13:00"}',
+                False,
+                {"value": "10:00", "type": "default"},
+                {"value": "13:00", "type": "global"},
+            ),
+        ],
+        ids=["true_1", "true_2", "false_1", "false_2"],
+    )
     @setup_data
-    def test_is_active_true_1(self, tmp_path, schedule):
-        (schedule.client.data / "active_schedule.json").write_text(
-            json.dumps(
-                {
-                    "schedule": "Schedule 3.1",
-                    "variables": {
-                        "var1": {"value": "08:00", "type": "kwarg"},
-                        "var2": {"value": "10:00", "type": "default"},
-                        "var3": {"value": "12:00", "type": "global"},
-                    },
-                }
-            )
-        )
-        (schedule.client.data / "variables.json").write_text(
-            '{"var1": "06:00", "var3": "12:00"}'
-        )
-        schedule.set(refresh=True)
-        assert schedule.is_active()
-        assert schedule.current_variables == {
-            "var1": {"value": "08:00", "type": "kwarg"},
-            "var2": {"value": "10:00", "type": "default"},
-            "var3": {"value": "12:00", "type": "global"},
-        }
-
-    @setup_data
-    def test_is_active_true_2(self, tmp_path, schedule):
-        (schedule.client.data / "active_schedule.json").write_text(
-            json.dumps(
-                {
-                    "schedule": "Schedule 3.1",
-                    "variables": {
-                        "var1": {"value": "08:00", "type": "kwarg"},
-                        "var2": {"value": "10:00", "type": "default"},
-                        "var3": {"value": "12:00", "type": "global"},
-                    },
-                }
-            )
-        )
-        (schedule.client.data / "variables.json").write_text(
-            '{"var1": "06:00", "var2": "10:00", "var3": "12:00", "var4-extra": "14:00"}'
-        )
-        schedule.set(refresh=True)
-        assert schedule.is_active()
-        assert schedule.current_variables == {
-            "var1": {"value": "08:00", "type": "kwarg"},
-            "var2": {"value": "10:00", "type": "global"},
-            "var3": {"value": "12:00", "type": "global"},
-        }
-
-    @setup_data
-    def test_is_active_false_1(self, tmp_path, schedule):
-        (schedule.client.data / "active_schedule.json").write_text(
-            json.dumps(
-                {
-                    "schedule": "Schedule 3.1",
-                    "variables": {
-                        "var1": {"value": "08:00", "type": "kwarg"},
-                        "var2": {"value": "10:00", "type": "default"},
-                        "var3": {"value": "12:00", "type": "global"},
-                    },
-                }
-            )
-        )
-        (schedule.client.data / "variables.json").write_text(
-            '{"var1": "06:00", "var2": "11:00", "var3": "12:00"}'
-        )
-        schedule.set(refresh=True)
-        assert not schedule.is_active()
-        assert schedule.current_variables == {
-            "var1": {"value": "08:00", "type": "kwarg"},
-            "var2": {"value": "11:00", "type": "global"},
-            "var3": {"value": "12:00", "type": "global"},
-        }
-
-    @setup_data
-    def test_is_active_false_2(self, tmp_path, schedule):
-        (schedule.client.data / "active_schedule.json").write_text(
-            json.dumps(
-                {
-                    "schedule": "Schedule 3.1",
-                    "variables": {
-                        "var1": {"value": "08:00", "type": "kwarg"},
-                        "var2": {"value": "10:00", "type": "default"},
-                        "var3": {"value": "12:00", "type": "global"},
-                    },
-                }
-            )
-        )
-        (schedule.client.data / "variables.json").write_text(
-            '{"var1": "06:00", "var3": "13:00"}'
+    def test_is_active(self, tmp_path, schedule, variables, active, var2, var3):
+        (schedule.client.data / "active_schedule.json").write_bytes(
+            ACTIVE_SCHEDULE_3_1_JSON
         )
+        (schedule.client.data / "variables.json").write_bytes(variables)
         schedule.set(refresh=True)
-        assert not schedule.is_active()
+        assert schedule.is_active() is active
         assert schedule.current_variables == {
             "var1": {"value": "08:00", "type": "kwarg"},
-            "var2": {"value": "10:00", "type": "default"},
-            "var3": {"value": "13:00", "type": "global"},
+            "var2": var2,
+            "var3": var3,
         }
 
 
@@ -460,7 +471,7 @@ class TestZoneSchedule:
         active_timetable = zone_schedule.active_timetable
 
         tado_client.requests_session.get.assert_called_once_with(
-            url="http://localhost:8080/api/v2/homes/123/zones/1/schedule/activeTimetable",
+            "http://localhost:8080/api/v2/homes/123/zones/1/schedule/activeTimetable",
             headers={"Authorization": "Bearer access-token"},
         )
         assert active_timetable == 0
@@ -525,6 +536,24 @@ class TestZoneSchedule:
             headers={"Authorization": "Bearer access-token"},
         )
 
+    @pytest.mark.parametrize("method, action", [("get", "pull"), ("put", "push")])
+    def test_not_found_forgets_active_timetable(
+        self, tado_client, mock_tado_auth, mock_tado_home_id, method, action
+    ):
+        zone_schedule = ZoneSchedule(
+            client=tado_client, zone={"id": 1, "name": "Dining Room"}
+        )
+        tado_client._active_timetables[1] = (0, float("inf"))
+        getattr(tado_client.requests_session, method).return_value = Mock(
+            status_code=404,
+            **{"raise_for_status.side_effect": requests.HTTPError("404")},
+        )
+
+        with pytest.raises(requests.HTTPError):
+            getattr(zone_schedule, action)()
+
+        assert 1 not in tado_client._active_timetables
+
     def test_set(self, tado_client):
         zone_schedule = ZoneSchedule(
             client=tado_client, zone={"id": 1, "name": "Dining Room"}
@@ -565,14 +594,7 @@ class TestZoneSchedule:
 class TestSchedules:
     def test_merge_timetables_1(self):
         merged = Schedules.merge_timetables(
-            [
-                ("01:00", "03:00", 0),
-                ("03:00", "05:00", 3),
-                ("05:00", "07:00", 5),
-                ("07:00", "09:00", 7),
-                ("09:00", "18:00", 9),
-                ("18:00", "01:00", 18),
-            ],
+            BASE_TIMETABLE,
             [
                 ("02:00", "02:30", 2),
                 ("02:30", "03:30", "reset"),
@@ -596,14 +618,7 @@ class TestSchedules:
 
     def test_merge_timetables_2(self):
         merged = Schedules.merge_timetables(
-            [
-                ("01:00", "03:00", 0),
-                ("03:00", "05:00", 3),
-                ("05:00", "07:00", 5),
-                ("07:00", "09:00", 7),
-                ("09:00", "18:00", 9),
-                ("18:00", "01:00", 18),
-            ],
+            BASE_TIMETABLE,
             [
                 ("03:00", "05:00", 2),
                 ("05:00", "09:00", "reset"),
@@ -637,6 +652,29 @@ class TestSchedules:
             ("23:00", "01:00", 1),
         ]
 
+    def test_merge_timetables_4(self):
+        merged = Schedules.merge_timetables(
+            [("06:00", "18:00", 5), ("18:00", "06:00", 3)],
+            [("18:00", "06:00", 5)],
+        )
+        assert merged == [("00:00", "00:00", 5)]
+
+    def test_clean_timetable(self):
+        cleaned = Schedules.clean_timetable(
+            [
+                ("00:00", "06:00", 0),
+                ("06:00", "06:00", 3),
+                ("06:00", "09:00", 18),
+                ("09:00", "12:00", 18),
+                ("12:00", "00:00", 0),
+            ]
+        )
+        assert cleaned == [
+            ("00:00", "06:00", 0),
+            ("06:00", "12:00", 18),
+            ("12:00", "00:00", 0),
+        ]
+
     def test_empty_zone(self, tmp_path):
         (tmp_path / "s.toml").write_text(
             '[metadata]\nname = "S1"\n\n[[z1]]\ntime = "23:15"\ntemperature = 10'
@@ -671,3 +709,58 @@ class TestSchedules:
                 "start": "00:00",
             },
         ]
+
+    def test_toml_cache(self, tmp_path):
+        path = tmp_path / "s.toml"
+        path.write_text(
+            '[metadata]\nname = "S1"\n\n[[z1]]\ntime = "06:00"\ntemperature = 10'
+        )
+        assert Schedules(tmp_path).load("S1")["z1"][0]["setting"]["power"] == "ON"
+
+        hits = load_variants.cache_info().hits
+        assert list(Schedules(tmp_path).schedules) == ["S1"]
+        assert load_variants.cache_info().hits == hits + 1
+
+        path.write_text(
+            '[metadata]\nname = "S2"\n\n[[z1]]\ntime = "06:00"\ntemperature = 0'
+        )
+        os.utime(path, ns=(0, path.stat().st_mtime_ns + 1))
+        assert Schedules(tmp_path).load("S2")["z1"][0]["setting"]["power"] == "OFF"
+
+    def test_schedules_cache(self, tmp_path):
+        path = tmp_path / "s.toml"
+        path.write_text('[metadata]\nname = "S1"\nvar1 = "06:00"')
+        schedules = load_schedules(tmp_path, {"var1": "07:00"})
+        assert schedules.variables_values("S1") == {"var1": "07:00"}
+        assert load_schedules(tmp_path, {"var1": "07:00"}) is schedules
+
+        schedules = load_schedules(tmp_path, {"var1": "08:00"})
+        assert schedules.variables_values("S1") == {"var1": "08:00"}
+
+        path.write_text('[metadata]\nname = "S2"')
+        os.utime(path, ns=(0, path.stat().st_mtime_ns + 1))
+        assert list(load_schedules(tmp_path).schedules) == ["S2"]
+
+    def test_schedule_to_timetable_does_not_mutate(self):
+        schedule = [
+            {"time": "{var1|-00:30}", "temperature": 18},
+            {"time": "22:00", "temperature": 0},
+        ]
+        timetable = Schedules.schedule_to_timetable(schedule, var1="07:00")
+        assert timetable == [
+            ("00:00", "06:30", 0),
+            ("06:30", "22:00", 18),
+            ("22:00", "00:00", 0),
+        ]
+        assert schedule[0]["time"] == "{var1|-00:30}"
+
+    def test_load_zone_cache(self):
+        schedules = Schedules(SAMPLE_DIR, zones=[{"name": "Bathroom"}])
+        bathroom = schedules.load_zone("Schedule 4", "bathroom", tado_format=False)
+        assert schedules.load_zone("Schedule 4", "bathroom", tado_format=False) is (
+            bathroom
+        )
+        assert schedules.load_zone(
+            "Schedule 4", "bathroom", tado_format=False, var1="07:30"
+        ) == [("00:00", "07:30", 0), ("07:30", "23:30", 18), ("23:30", "00:00", 0)]
+        assert len(schedules._timetables) == 2
@@ -1,17 +1,32 @@
 import pytest
 
-from smart.schedule_utils import ScheduleVariables, parse_dynamic_times
+from smart.schedule_utils import ScheduleVariables, parse_dynamic_times, to_minutes
 
 
 def test_parse_dynamic_times_raises_exception():
     with pytest.raises(KeyError):
         parse_dynamic_times([{"time": "{var2}"}])
-    for time in ["{var1|01:00}", "{var1|+1:00}", "{var1|-1:00}"]:
+    for time in ["{var1|01:00}", "{var1|+1:00}", "{var1|-1:00}", "{var1|+24:00}"]:
         with pytest.raises(ValueError, match="not a valid dynamic format"):
             parse_dynamic_times([{"time": time}], var1="07:00")
-    for time in ["aaa", "7:00", "0700"]:
+    for time in ["aaa", "7:00", "0700", "24:00", "07:60"]:
         with pytest.raises(ValueError, match="not a valid static format"):
             parse_dynamic_times([{"time": time}])
+    for value in ["aaa", "0700", "24:00", "07:60", "7:"]:
+        with pytest.raises(ValueError, match="not a valid static format"):
+            parse_dynamic_times([{"time": "{var1}"}], var1=value)
+
+
+def test_parse_dynamic_times_unpadded_variables():
+    schedule = [{"time": "{var1}"}, {"time": "{var2|+01:00}"}, {"time": "{var3}"}]
+    parse_dynamic_times(schedule, var1="7:30", var2="07:5", var3="0:0")
+    assert schedule == [{"time": "07:30"}, {"time": "08:05"}, {"time": "00:00"}]
+
+
+def test_parse_dynamic_times_wraps_midnight():
+    schedule = [{"time": "{var1|+01:00}"}, {"time": "{var2|-01:00}"}]
+    parse_dynamic_times(schedule, var1="23:30", var2="00:30")
+    assert schedule == [{"time": "00:30"}, {"time": "23:30"}]
 
 
 class TestScheduleVariables:
@@ -48,35 +63,59 @@ class TestScheduleVariables:
         with pytest.raises(KeyError):
             sv["var2"]
 
+    @pytest.mark.parametrize(
+        "other, equal",
+        [
+            ({"var1": "07:00"}, True),
+            ({"var1": "07:01"}, False),
+            ({"var2": "07:00"}, False),
+            ({"var1": "07:00", "var2": "07:00"}, False),
+            ("07:00", False),
+        ],
+    )
+    def test_eq_mapping(self, other, equal):
+        sv = ScheduleVariables()
+        sv.add_default(var1="07:00")
+        assert (sv == other) is equal
+
     def test_eq(self):
         sv1 = ScheduleVariables()
-        sv1.add_default(var1="07:00")
+        sv1.add_default(var1="07:00", var2="08:00")
         sv2 = ScheduleVariables()
         sv2.add_default(var1="07:00")
-        assert sv1 == sv2
-        assert sv1 == {"var1": "07:00"}
-        assert sv1 != {"var1": "07:01"}
-        assert sv1 != {"var2": "07:00"}
-        assert sv1 != {"var1": "07:00", "var2": "07:00"}
-        assert sv1 != {"var1": "07:00", "var2": "07:00"}
-        sv1.add_default(var2="08:00")
         assert sv1 != sv2
         sv2.add_default(var2="08:00")
         assert sv1 == sv2
         assert sv1.data == sv2.data
+
+    def test_eq_ignores_type(self):
+        sv1 = ScheduleVariables()
+        sv1.add_default(var1="07:00", var2="08:00")
+        sv2 = ScheduleVariables()
+        sv2.add_default(var1="07:00")
         sv2.add_global(var2="08:00")
         assert sv1 == sv2
         assert sv1.data != sv2.data
         sv2.add_global(var2="09:00")
         assert sv1 != sv2
-        sv2.add_kwarg(var1="06:00", var2="10:00")
-        assert sv2.data == {
+
+    def test_kwarg_precedence(self):
+        sv = ScheduleVariables()
+        sv.add_global(var2="09:00")
+        sv.add_kwarg(var1="06:00", var2="10:00")
+        assert sv.data == {
             "var1": {"type": "kwarg", "value": "06:00"},
             "var2": {"type": "kwarg", "value": "10:00"},
         }
-        sv2.add_global(var2="07:00")
-        assert sv2["var2"] == "10:00"
-        sv2.add_default(var2="07:00")
-        assert sv2["var2"] == "10:00"
-        sv2.add_kwarg(var2="07:00")
-        assert sv2["var2"] == "07:00"
+        sv.add_global(var2="07:00")
+        assert sv["var2"] == "10:00"
+        sv.add_default(var2="07:00")
+        assert sv["var2"] == "10:00"
+        sv.add_kwarg(var2="07:00")
+        assert sv["var2"] == "07:00"
+
+
+def test_to_minutes():
+    assert to_minutes("00:00") == 0
+    assert to_minutes("07:05") == 425
+    assert to_minutes("23:59") == 1439
@@ -1,14 +1,20 @@
+import time
 from pathlib import Path
 from unittest.mock import patch, PropertyMock
 
 import pytest
+import requests
 
 from smart.tado import TadoClient
 
 
 class HttpResponse:
-    def __init__(self, json=None):
+    __slots__ = ("_json", "status_code", "headers")
+
+    def __init__(self, json=None, status_code=200, headers=None):
         self._json = json
+        self.status_code = status_code
+        self.headers = headers or {}
 
     def json(self):
         return self._json
@@ -21,7 +27,7 @@ class TestTado:
     def test_setup_tado_client(self, tado_client):
         assert tado_client.username == "username"
         assert tado_client.password == "password"
-        assert tado_client.data == Path(".")
+        assert tado_client.data.is_dir()
         assert tado_client.env == "http://localhost:8080/webapp/env.js"
         assert tado_client.oauth_endpoint == "http://localhost:8080/oauth"
         assert tado_client.client_id == "client-id"
@@ -39,6 +45,12 @@ class TestTado:
                 data=".",
             )
             assert tado_client.env == "https://my.tado.com/webapp/env.js"
+            adapter = tado_client.requests_session.get_adapter("https://my.tado.com")
+            assert adapter._pool_connections == 16
+            assert adapter._pool_maxsize == 32
+            assert adapter.max_retries.total == 3
+            assert adapter.max_retries.status_forcelist == (502, 503, 504)
+            assert tado_client.requests_session.get_adapter("http://x") is adapter
 
     def test_get_env(self, tado_client):
         with patch("smart.tado.TadoClient._env", new_callable=PropertyMock) as mock_env:
@@ -78,43 +90,193 @@ class TestTado:
             },
         )
 
-    def test_home_id(self, tado_client, mock_tado_auth):
+    def test_auth_expired(self, tado_client):
+        tado_client.requests_session.post.side_effect = [
+            HttpResponse(json={"access_token": "token-1", "expires_in": 600}),
+            HttpResponse(json={"access_token": "token-2", "expires_in": 600}),
+        ]
+        assert tado_client.access_token == "token-1"
+        auth = tado_client.auth
+        assert tado_client.auth is auth
+        tado_client._access_token_expiry = 0.0
+        assert tado_client.auth == {"Authorization": "Bearer token-2"}
+        assert tado_client.requests_session.post.call_count == 2
+
+    def test_auth_refreshed_by_other_thread(self, tado_client):
+        class RefreshingLock:
+            def __enter__(self):
+                tado_client._access_token = "token-other"
+                tado_client._access_token_expiry = time.monotonic() + 600
+
+            def __exit__(self, *args):
+                pass
+
+        tado_client._token_lock = RefreshingLock()
+        assert tado_client.access_token == "token-other"
+        tado_client.requests_session.post.assert_not_called()
+
+    def test_auth_refresh_ahead(self, tado_client):
+        tado_client.requests_session.post.side_effect = [
+            HttpResponse(json={"access_token": "token-1", "expires_in": 600}),
+            HttpResponse(json={"access_token": "token-2", "expires_in": 600}),
+        ]
+        assert tado_client.access_token == "token-1"
+        tado_client._access_token_expiry = time.monotonic() + 60
+
+        tado_client._token_lock.acquire()  # a refresh is already running
+        assert tado_client.access_token == "token-1"
+        assert tado_client._refresh_thread is None
+        tado_client._token_lock.release()
+
+        assert tado_client.access_token in ("token-1", "token-2")
+        tado_client._refresh_thread.join()
+        assert tado_client.access_token == "token-2"
+        assert tado_client.auth == {"Authorization": "Bearer token-2"}
+
+    def test_auth_refresh_ahead_fails(self, tado_client):
+        tado_client.requests_session.post.side_effect = [
+            HttpResponse(json={"access_token": "token-1", "expires_in": 600}),
+            requests.ConnectionError(),
+        ]
+        assert tado_client.access_token == "token-1"
+        tado_client._access_token_expiry = time.monotonic() + 60
+        assert tado_client.access_token == "token-1"
+        tado_client._refresh_thread.join()
+        assert tado_client._access_token == "token-1"
+        assert not tado_client._token_lock.locked()
+
+    def test_home_id(self, tmp_path, tado_client, mock_tado_auth):
+        tado_client.data = tmp_path
         tado_client.requests_session.get.return_value = HttpResponse(
-            json={"homeId": "123"}
+            json={"homeId": "123", "email": "user@example.com"}
         )
         assert tado_client.home_id == "123"
+        assert tado_client.home_id == "123"
         tado_client.requests_session.get.assert_called_once_with(
             "http://localhost:8080/api/v1/me",
             headers={"Authorization": "Bearer access-token"},
         )
+        assert b"user@example.com" not in (tmp_path / "http_cache.json").read_bytes()
 
-    def test_zones(self, tado_client, mock_tado_auth, mock_tado_home_id):
-        zones = [
-            {"id": 1, "name": "Dining Room", "type": "HEATING"},
-            {"id": 2, "name": "Bathroom", "type": "HEATING"},
-            {"id": 3, "name": "Living Room", "type": "HEATING"},
-        ]
+        tado_client.METADATA_MAX_AGE = 0  # expire straight away
+        tado_client.requests_session.get.return_value = HttpResponse(
+            json={"homeId": "456"}
+        )
+        assert tado_client.home_id == "456"
+        assert tado_client.home_endpoint == "http://localhost:8080/api/v2/homes/456"
+
+    def test_zones(self, tado_client, mock_tado_auth, mock_tado_home_id, zones):
         tado_client.requests_session.get.return_value = HttpResponse(json=zones)
         assert tado_client.zones == zones
+        assert tado_client.zones == zones
         tado_client.requests_session.get.assert_called_once_with(
             "http://localhost:8080/api/v2/homes/123/zones",
             headers={"Authorization": "Bearer access-token"},
         )
 
+    def test_active_timetable(self, tado_client, mock_tado_auth, mock_tado_home_id):
+        tado_client.requests_session.get.return_value = HttpResponse(
+            json={"id": 0, "type": "ONE_DAY"}
+        )
+        assert tado_client.active_timetable(1) == 0
+        assert tado_client.active_timetable(1) == 0
+        tado_client.requests_session.get.assert_called_once_with(
+            "http://localhost:8080/api/v2/homes/123/zones/1/schedule/activeTimetable",
+            headers={"Authorization": "Bearer access-token"},
+        )
+
+        tado_client.clear_active_timetables()
+        assert tado_client.active_timetable(1) == 0
+        assert tado_client.requests_session.get.call_count == 2
+
+        tado_client.ACTIVE_TIMETABLE_MAX_AGE = 0  # expire straight away
+        tado_client.clear_active_timetables()
+        assert tado_client.active_timetable(1) == 0
+        assert tado_client.active_timetable(1) == 0
+        assert tado_client.requests_session.get.call_count == 4
+
+    def test_http_cache(self, tmp_path, tado_client, mock_tado_auth):
+        tado_client.data = tmp_path
+        url = "http://localhost:8080/api/v1/me"
+        get = tado_client.requests_session.get
+        get.return_value = HttpResponse(json={"homeId": "123"}, headers={"ETag": "a"})
+        assert tado_client._get_json(url) == {"homeId": "123"}
+        get.assert_called_once_with(
+            url, headers={"Authorization": "Bearer access-token"}
+        )
+
+        get.return_value = HttpResponse(status_code=304)
+        del tado_client._http_cache  # reload the persisted copy
+        with patch("smart.tado.atomic_write_bytes") as write:
+            assert tado_client._get_json(url) == {"homeId": "123"}
+            get.return_value = HttpResponse(
+                json={"homeId": "123"}, headers={"ETag": "a"}
+            )
+            assert tado_client._get_json(url) == {"homeId": "123"}
+        write.assert_not_called()  # unchanged, so not rewritten
+        get.assert_called_with(
+            url,
+            headers={"Authorization": "Bearer access-token", "If-None-Match": "a"},
+        )
+        assert list(tmp_path.iterdir()) == [tmp_path / "http_cache.json"]
+
+        tado_client.username = "other_username"
+        get.return_value = HttpResponse(json={"homeId": "456"})
+        assert tado_client._get_json(url) == {"homeId": "456"}
+        get.assert_called_with(url, headers={"Authorization": "Bearer access-token"})
+
+    def test_http_cache_max_age(self, tmp_path, tado_client, mock_tado_auth):
+        tado_client.data = tmp_path
+        url = "http://localhost:8080/api/v1/me"
+        get = tado_client.requests_session.get
+        get.return_value = HttpResponse(json={"homeId": "123"})
+        assert tado_client._get_json(url, max_age=60) == {"homeId": "123"}
+
+        del tado_client._http_cache  # reload the persisted copy
+        assert tado_client._get_json(url, max_age=60) == {"homeId": "123"}
+        get.assert_called_once_with(
+            url, headers={"Authorization": "Bearer access-token"}
+        )
+
+        get.return_value = HttpResponse(json={"homeId": "456"})
+        assert tado_client._get_json(url) == {"homeId": "456"}
+        assert get.call_count == 2
+
+    def test_http_cache_without_age(self, tmp_path, tado_client, mock_tado_auth):
+        tado_client.data = tmp_path
+        url = "http://localhost:8080/api/v1/me"
+        tado_client._http_cache = {
+            f"{tado_client.username} {url}": {"etag": "a", "body": {"homeId": "123"}}
+        }
+        get = tado_client.requests_session.get
+        get.return_value = HttpResponse(status_code=304)
+        assert tado_client._get_json(url, max_age=60) == {"homeId": "123"}
+        assert tado_client._get_json(url, max_age=60) == {"homeId": "123"}
+        get.assert_called_once_with(
+            url,
+            headers={"Authorization": "Bearer access-token", "If-None-Match": "a"},
+        )
+
     def test_set_home(self, tado_client, mock_tado_auth, mock_tado_home_id):
         tado_client.set_home()
         tado_client.requests_session.put.assert_called_once_with(
             "http://localhost:8080/api/v2/homes/123/presenceLock",
-            json={"homePresence": "HOME"},
-            headers={"Authorization": "Bearer access-token"},
+            data=b'{"homePresence":"HOME"}',
+            headers={
+                "Authorization": "Bearer access-token",
+                "Content-Type": "application/json",
+            },
         )
 
     def test_set_away(self, tado_client, mock_tado_auth, mock_tado_home_id):
         tado_client.set_away()
         tado_client.requests_session.put.assert_called_once_with(
             "http://localhost:8080/api/v2/homes/123/presenceLock",
-            json={"homePresence": "AWAY"},
-            headers={"Authorization": "Bearer access-token"},
+            data=b'{"homePresence":"AWAY"}',
+            headers={
+                "Authorization": "Bearer access-token",
+                "Content-Type": "application/json",
+            },
         )
 
     def test_get_presence(self, tado_client, mock_tado_auth, mock_tado_home_id):
@@ -0,0 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+from smart.utils import UMASK, atomic_write_bytes
+
+
+def test_atomic_write_bytes(tmp_path):
+    path = tmp_path / "data.json"
+    atomic_write_bytes(path, b'{"a": 1}')
+    atomic_write_bytes(path, b'{"a": 2}')
+    assert path.read_bytes() == b'{"a": 2}'
+    assert list(tmp_path.iterdir()) == [path]
+    assert path.stat().st_mode & 0o777 == 0o666 & ~UMASK
+
+
+def test_atomic_write_bytes_threads(tmp_path):
+    path = tmp_path / "data.json"
+    bodies = [f'{{"a": {i}}}'.encode() for i in range(50)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda body: atomic_write_bytes(path, body), bodies))
+    assert path.read_bytes() in bodies
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_atomic_write_bytes_cleans_up(tmp_path):
+    path = tmp_path / "data.json"
+    with patch("os.replace", side_effect=OSError("failed")):
+        with pytest.raises(OSError, match="failed"):
+            atomic_write_bytes(path, b'{"a": 1}')
+    assert list(tmp_path.iterdir()) == []